@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the game hot paths. Run them from the project root, for example:
+
+    python -m benchmarks.playfield
+"""
+import os
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gameness.settings")
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """
+    Run the block against a fresh test database, the same way the test runner does, so benchmarks never touch the
+    real one
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
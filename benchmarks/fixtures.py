@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Fast fixture generator for benchmarks at large data scales. Rows are built in memory and written with bulk_create in
+chunks, model_mommy.make issues several queries per object and takes hours for a million games.
+
+Call setup_django first, the models are imported lazily.
+"""
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+CHUNK_SIZE = 5000
+
+
+def chunked(items, size):
+    """
+    Yield lists of at most size items
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def generate_games(count, players=None, rows=2, columns=3, suspected_rate=0.01, chunk_size=CHUNK_SIZE, seed=0):
+    """
+    Bulk create finished games together with the PlayerBest leaderboard and the SuspectedGame records that finishing
+    them through the views would have produced. Turns are not created, scoring reads the Game turn counters.
+    Meant for an empty database such as benchmarks.test_database, existing PlayerBest rows of the generated players
+    collide with the new ones.
+    :param count: number of games
+    :param players: number of distinct players, defaults to one per ten games
+    :param rows: y rows of the boards
+    :param columns: x columns of the boards
+    :param suspected_rate: share of the games played faster than settings.SUSPECTED_THRESHOLD
+    :param chunk_size: games built in memory per bulk_create, bulk_create splits them further into batches the
+                       database accepts
+    :param seed: seed for the generated values, the same arguments give the same data
+    :return: range of the created game ids
+    """
+    from django.conf import settings
+    from django.db import transaction
+    from django.db.models import Max
+    from django.utils import timezone
+
+    from gameness import playfield as playfields
+    from gameness.models import Game, PlayerBest, SuspectedGame
+
+    rng = random.Random(seed)
+    players = [f"player-{i}@email.com" for i in range(players or max(1, count // 10))]
+    # Decoding is what is being measured, so a handful of real boards is enough
+    boards = [(board_seed, playfields.generate_board(rows, columns, board_seed).to_bytes())
+              for board_seed in (uuid.UUID(int=rng.getrandbits(128)).hex for i in range(16))]
+    pairs = (rows * columns) // 2
+    threshold = settings.SUSPECTED_THRESHOLD
+    now = timezone.now()
+
+    first_id = (Game.objects.aggregate(last=Max("id"))["last"] or 0) + 1 # Explicit ids, so PlayerBest can point at them
+    best = {} # player -> (score, game id)
+    suspected = [] # (game id, player, average time)
+
+    def build_games():
+        for pk in range(first_id, first_id + count):
+            player = rng.choice(players)
+            board_seed, board_data = rng.choice(boards)
+            misses = rng.randint(0, pairs * 2)
+            turns = pairs + misses
+            if rng.random() < suspected_rate:
+                average_time = Decimal(rng.uniform(0.2, threshold * 0.9)).quantize(Decimal("0.001"))
+            else:
+                average_time = Decimal(rng.uniform(threshold, 6.0)).quantize(Decimal("0.001"))
+            first_turn_at = now - timedelta(seconds=rng.randint(60, 3600 * 24 * 30))
+            last_turn_at = first_turn_at + timedelta(seconds=float(average_time) * turns)
+
+            game = Game(id=pk, seed=board_seed, player=player, game_type=Game.MEMORY, active=False, finished=True,
+                        board_data=board_data, average_time=average_time, engine=playfields.ENGINE_SHUFFLE,
+                        turns_total=turns, turns_correct=pairs, first_turn_at=first_turn_at,
+                        last_turn_at=last_turn_at)
+            game.score = game.calculate_score().quantize(Decimal("0.001"))
+
+            if average_time < threshold:
+                suspected.append((pk, player, average_time))
+            if player not in best or best[player][0] < game.score:
+                best[player] = (game.score, pk)
+            yield game
+
+    with transaction.atomic():
+        for games in chunked(build_games(), chunk_size):
+            Game.objects.bulk_create(games)
+
+        suspected_games = {}
+        for pk, player, average_time in suspected:
+            suspected_games[player] = suspected_games.get(player, 0) + 1
+        SuspectedGame.objects.bulk_create(
+            (SuspectedGame(game_id=pk, player=player,
+                           reason=f"The round {pk} by {player} may be cheating. Average time for a round is "
+                                  f"{average_time}.")
+             for pk, player, average_time in suspected))
+
+        PlayerBest.objects.bulk_create(
+            (PlayerBest(player=player, score=score, game_id=pk, achieved=now,
+                        suspected_games=suspected_games.get(player, 0),
+                        disqualified=suspected_games.get(player, 0) > settings.SUSPECTED_GAMES_LIMIT)
+             for player, (score, pk) in best.items()))
+
+    return range(first_id, first_id + count)
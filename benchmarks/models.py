@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Micro benchmarks of the model hot paths at several data scales, written as JSON so that runs of two commits can be
+compared mechanically.
+
+    python -m benchmarks.models [--scales 1k,100k,1M] [--output results.json] [--compare baseline.json]
+
+Every scale gets a fresh test database filled by benchmarks.fixtures.generate_games. The times are per call in
+microseconds, "min" is the best of --repeat rounds and "median" the median of them. With --compare every benchmark is
+printed next to the same benchmark of an earlier run and the process exits with status 1 when one of them got slower
+than --threshold. The progress and the comparison go to stderr.
+"""
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+from benchmarks import setup_django, test_database
+
+
+def parse_scale(value):
+    """
+    "1k" -> 1000, "1M" -> 1000000
+    """
+    multipliers = {"k": 1000, "m": 1000000}
+    value = value.strip()
+    if value[-1:].lower() in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1:].lower()])
+    return int(value)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def hot_paths(rows, columns):
+    """
+    The benchmarked callables, every one is a function without arguments
+    :return: list of (name, function)
+    """
+    import uuid
+
+    from django.conf import settings
+    from gameness.models import Game, SuspectedGame
+
+    game = Game.objects.filter(finished=True).order_by("id").first()
+    active = Game.objects.create(player=game.player, seed=game.seed, engine=game.engine, board_data=game.board_data,
+                                 active=True, finished=False)
+    active.get_board() # Warm the board cache like the first click of a game does
+    suspected = Game.objects.filter(average_time__lt=settings.SUSPECTED_THRESHOLD).order_by("id").first() or game
+    seed = uuid.uuid4().hex
+    row, column = rows // 2, columns // 2
+
+    return [
+        ("generate_play_field", lambda: Game.generate_play_field(rows, columns, seed)),
+        ("get_card_id", lambda: active.get_card_id({"row": row, "column": column})),
+        ("match", lambda: active.match([{"row": 0, "column": 0}, {"row": row, "column": column}])),
+        ("calculate_score", game.calculate_score),
+        ("get_highscores", lambda: list(Game.objects.get_highscores()[:5])),
+        ("get_unique_highscores", Game.objects.get_unique_highscores),
+        ("is_game_suspected", lambda: SuspectedGame.is_game_suspected(suspected)),
+    ]
+
+
+def measure(function, repeat, min_time=0.2):
+    """
+    Time one callable, the number of calls per round is calibrated to take at least min_time seconds
+    :return: {'number', 'min_us', 'median_us'}
+    """
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / elapsed)) if elapsed < min_time else number
+    timings = [seconds / number for seconds in timer.repeat(repeat=repeat, number=number)]
+    return {"number": number, "min_us": min(timings) * 1e6, "median_us": statistics.median(timings) * 1e6}
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the results next to an earlier run
+    :return: names of the benchmarks which got slower than threshold
+    """
+    earlier = dict(((result["scale"], result["name"]), result) for result in baseline["results"])
+    regressions = []
+    print(f"\nCompared to {baseline.get('commit') or 'baseline'}", file=sys.stderr)
+    print(f"{'scale':>9} {'benchmark':<22} {'before us':>10} {'after us':>10} {'change':>8}", file=sys.stderr)
+    for result in results:
+        before = earlier.get((result["scale"], result["name"]))
+        if before is None:
+            continue
+        change = result["min_us"] / before["min_us"] - 1
+        marker = " !" if change > threshold else ""
+        print(f"{result['scale']:>9} {result['name']:<22} {before['min_us']:10.1f} {result['min_us']:10.1f} "
+              f"{change:+7.0%}{marker}", file=sys.stderr)
+        if change > threshold:
+            regressions.append(f"{result['name']} at {result['scale']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1k,100k,1M", help="Comma separated numbers of games, k and M suffixes")
+    parser.add_argument("--rows", type=int, default=2)
+    parser.add_argument("--columns", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5, help="Timed rounds per benchmark")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative slowdown reported as a regression by --compare")
+    args = parser.parse_args()
+    scales = [parse_scale(scale) for scale in args.scales.split(",")]
+
+    setup_django()
+    import django
+    from django.db import connection
+    from benchmarks.fixtures import generate_games
+
+    results = []
+    for scale in scales:
+        with test_database():
+            start_time = time.perf_counter()
+            generate_games(scale, rows=args.rows, columns=args.columns)
+            print(f"{scale} games generated in {time.perf_counter() - start_time:.1f} s", file=sys.stderr)
+            for name, function in hot_paths(args.rows, args.columns):
+                result = dict(scale=scale, name=name, **measure(function, args.repeat))
+                print(f"{scale:>9} {name:<22} {result['min_us']:10.1f} us", file=sys.stderr)
+                results.append(result)
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "board": f"{args.rows}x{args.columns}",
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
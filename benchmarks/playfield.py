@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the playfield engines on boards from 2x3 up to 100x100.
+
+    python -m benchmarks.playfield [--repeat 5] [--legacy-max-squares 400]
+
+The legacy engine is rejection sampling and slows down dramatically as the board grows, so it is skipped above
+--legacy-max-squares (a 32x32 board already takes seconds, 100x100 does not finish in reasonable time).
+"""
+import argparse
+import time
+import uuid
+
+from gameness import playfield as playfields
+
+SIZES = ((2, 3), (4, 4), (6, 6), (8, 8), (10, 10), (16, 16), (20, 20), (32, 32), (64, 64), (100, 100))
+
+
+def best_time(engine, row, column, seeds):
+    """
+    Best wall clock time in seconds for generating one board
+    """
+    timings = []
+    for seed in seeds:
+        start_time = time.perf_counter()
+        playfields.generate(row, column, seed, engine)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Boards generated per size and engine")
+    parser.add_argument("--legacy-max-squares", type=int, default=400,
+                        help="Skip the legacy engine for boards larger than this")
+    args = parser.parse_args()
+
+    seeds = [uuid.uuid4().hex for i in range(args.repeat)]
+    print(f"{'board':>9} {'legacy ms':>12} {'shuffle ms':>12} {'speedup':>9}")
+    for row, column in SIZES:
+        shuffle = best_time(playfields.ENGINE_SHUFFLE, row, column, seeds)
+        if row * column <= args.legacy_max_squares:
+            legacy = best_time(playfields.ENGINE_LEGACY, row, column, seeds)
+            legacy_text, speedup_text = f"{legacy * 1000:12.3f}", f"{legacy / shuffle:8.1f}x"
+        else:
+            legacy_text, speedup_text = f"{'skipped':>12}", f"{'-':>9}"
+        print(f"{row:>4}x{column:<4} {legacy_text} {shuffle * 1000:12.3f} {speedup_text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Counts the database writes made by ContestGameView while playing one game with each game state engine.
+
+    python -m benchmarks.session_writes [--rows 4 --columns 4] [--misses 4]
+
+Every game is played through the test client against a fresh test database, a write is any INSERT, UPDATE or DELETE
+issued by the clicks. Session writes are the ones to django_session.
+"""
+import argparse
+import json
+import uuid
+
+from benchmarks import setup_django, test_database
+
+ENGINES = ("session", "hybrid", "cache")
+
+
+def start_game(client, rows, columns):
+    """
+    Start a game and give it a board of the requested size
+    :return: list of moves which plays the game to the end, pairs sorted by card id
+    """
+    from django.urls import reverse
+    from gameness import playfield as playfields
+    from gameness.models import Game
+
+    client.get(reverse('contest_contest'))
+    game = Game.objects.last()
+    board = playfields.generate_board(rows, columns, uuid.uuid4().hex)
+    game.set_board(board)
+    game.save()
+
+    squares = {}
+    for square, card in enumerate(board.cells):
+        squares.setdefault(card, []).append(divmod(square, columns))
+    return [squares[card] for card in sorted(squares) if card != playfields.EMPTY]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=4)
+    parser.add_argument("--columns", type=int, default=4)
+    parser.add_argument("--misses", type=int, default=4, help="Missing turns played before the matching ones")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext, override_settings
+    from django.urls import reverse
+
+    url = reverse('contest_game_view')
+    print(f"{'engine':>8} {'clicks':>7} {'writes':>7} {'session':>8} {'per click':>10}")
+    with test_database():
+        for engine in ENGINES:
+            with override_settings(GAME_STATE_ENGINE=engine, PLAYFIELD_POOL_SIZE=0):
+                client = Client()
+                pairs = start_game(client, args.rows, args.columns)
+                misses = [(pairs[i][0], pairs[i + 1][0]) for i in range(min(args.misses, len(pairs) - 1))]
+                clicks = [square for move in misses + pairs for square in move]
+
+                with CaptureQueriesContext(connection) as queries:
+                    for row, column in clicks:
+                        client.post(url, data={'click': json.dumps({'row': row, 'column': column})})
+
+            writes = [query['sql'] for query in queries.captured_queries
+                      if query['sql'].startswith(("INSERT", "UPDATE", "DELETE"))]
+            session_writes = [sql for sql in writes if '"django_session"' in sql]
+            print(f"{engine:>8} {len(clicks):>7} {len(writes):>7} {len(session_writes):>8} "
+                  f"{len(writes) / len(clicks):10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-process stress test of the SQLite concurrency mode, see gameness/db.py.
+
+    python -m benchmarks.sqlite_stress [--processes 8] [--games 20] [--modes legacy,concurrent]
+
+Every process plays whole games through the test client against one shared database file, like gunicorn workers do.
+"legacy" is the configuration before the concurrency mode: rollback journal, the default busy timeout of the sqlite3
+module, a new connection per request and no retries. "concurrent" is the shipped configuration. Every mode gets its
+own copy of a freshly migrated database in a temporary directory, the real database is never touched. A request fails
+when it raises or does not answer 200, "locked" counts the failures caused by a locked database.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks import setup_django
+
+MODES = {
+    "legacy": {"OPTIONS": {}, "CONN_MAX_AGE": 0, "SQLITE_WAL": False, "DB_LOCK_RETRIES": 0},
+    "concurrent": {},
+}
+
+
+def configure(path, mode):
+    """
+    Point the settings at the database file and apply the mode, before Django is set up
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gameness.settings")
+    from django.conf import settings
+
+    database = settings.DATABASES["default"]
+    database["NAME"] = path
+    for key, value in MODES[mode].items():
+        if key in database:
+            database[key] = value
+        else:
+            setattr(settings, key, value)
+    settings.ALLOWED_HOSTS = ["testserver"]
+    settings.PLAYFIELD_POOL_SIZE = 0
+    setup_django()
+
+
+def play_games(path, mode, games):
+    """
+    Worker process, plays the games one after the other
+    :return: (latencies of the successful requests, failed requests, failures on a locked database)
+    """
+    configure(path, mode)
+    import json
+    from django.conf import settings
+    from django.db import OperationalError
+    from django.test import Client
+    from django.urls import reverse
+    from gameness import playfield as playfields
+    from gameness.models import Game
+
+    latencies, failed, locked = [], 0, 0
+
+    def request(method, url, **kwargs):
+        nonlocal failed, locked
+        start = time.perf_counter()
+        try:
+            response = method(url, **kwargs)
+        except OperationalError as e:
+            failed += 1
+            locked += "locked" in str(e)
+            return None
+        if response.status_code != 200:
+            failed += 1
+            return None
+        latencies.append(time.perf_counter() - start)
+        return response
+
+    for i in range(games):
+        # A player of its own, starting a game stops the other active games of the player
+        settings.USER_EMAILS = [f"{os.getpid()}.{i}@stress.test"]
+        client = Client()
+        if request(client.get, reverse('contest_contest')) is None:
+            continue
+        board = Game.objects.get(pk=client.session["game"]).get_board()
+        squares = {}
+        for square, card in enumerate(board.cells):
+            if card != playfields.EMPTY:
+                squares.setdefault(card, []).append(divmod(square, board.columns))
+        for pair in squares.values():
+            for row, column in pair:
+                request(client.post, reverse('contest_game_view'),
+                        data={'click': json.dumps({'row': row, 'column': column})})
+        request(client.get, reverse('contest_highscore'))
+    return latencies, failed, locked
+
+
+def migrate(path):
+    configure(path, "legacy")
+    from django.core.management import call_command
+    call_command("migrate", verbosity=0)
+
+
+def main():
+    from gameness.management.commands.loadtest import percentile
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--games", type=int, default=20, help="Games played by every process")
+    parser.add_argument("--modes", default=",".join(MODES))
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="sqlite-stress-")
+    context = multiprocessing.get_context("spawn")
+    try:
+        template = os.path.join(directory, "template.sqlite3")
+        with context.Pool(1) as pool:
+            pool.apply(migrate, (template,))
+
+        print(f"{'mode':>10} {'requests':>9} {'failed':>7} {'locked':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for mode in args.modes.split(","):
+            path = os.path.join(directory, f"{mode}.sqlite3")
+            shutil.copy(template, path)
+            start = time.perf_counter()
+            with context.Pool(args.processes) as pool:
+                results = pool.starmap(play_games, [(path, mode, args.games)] * args.processes)
+            elapsed = time.perf_counter() - start
+
+            latencies = [seconds for result in results for seconds in result[0]]
+            failed = sum(result[1] for result in results)
+            locked = sum(result[2] for result in results)
+            print(f"{mode:>10} {len(latencies) + failed:>9} {failed:>7} {locked:>7} {len(latencies) / elapsed:8.1f} "
+                  f"{percentile(latencies, 50) * 1000:8.1f} {percentile(latencies, 99) * 1000:8.1f}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the JSON playfield with the binary format on storage size, decoding and looking up one card.
+
+    python -m benchmarks.storage [--repeat 200]
+
+"json" is the old Game.get_card_id, json.loads of the whole matrix for every click, "binary" is
+playfield.Board.from_bytes followed by Board.card.
+"""
+import argparse
+import json
+import timeit
+import uuid
+
+from gameness import playfield as playfields
+
+SIZES = ((2, 3), (4, 4), (8, 8), (16, 16), (32, 32), (64, 64), (100, 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="Decodes timed per size and format")
+    args = parser.parse_args()
+
+    print(f"{'board':>9} {'json bytes':>11} {'binary bytes':>13} {'json us':>10} {'binary us':>10} {'speedup':>8}")
+    for row, column in SIZES:
+        board = playfields.generate_board(row, column, uuid.uuid4().hex)
+        text = json.dumps(board.to_matrix())
+        data = board.to_bytes()
+        y, x = row // 2, column // 2
+
+        json_time = min(timeit.repeat(lambda: json.loads(text)[y][x], number=args.repeat, repeat=3)) / args.repeat
+        binary_time = min(timeit.repeat(lambda: playfields.Board.from_bytes(data).card(y, x), number=args.repeat,
+                                        repeat=3)) / args.repeat
+        print(f"{row:>4}x{column:<4} {len(text.encode()):>11} {len(data):>13} {json_time * 1e6:10.1f} "
+              f"{binary_time * 1e6:10.1f} {json_time / binary_time:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
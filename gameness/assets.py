@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Static part of the data ContestView hands to the game: card images, sounds and fonts.
+
+The manifest only depends on the board dimensions and on the static files, so it is built once per process and
+dimensions and served by ContestAssetsView as a script the browser caches. Its ETag is a hash of the manifest, which
+changes with the static URLs (for example when a hashed static files storage is deployed), and its Last-Modified is
+the newest modification time of the files it refers to, so every worker answers a revalidation the same way.
+"""
+import datetime
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.templatetags.staticfiles import static
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+MAX_SIDE = 64 # Most rows or columns of a board with a manifest
+PIECES = ["img/memory/stack/{}.jpg".format(i) for i in range(1, 11)]
+FILES = {
+    "backPiece": "img/memory/card-backside-default.png",
+    "font_url": "games/fonts/press-start-2p.css",
+    "audio_win": "games/sfx/memory-win.wav",
+    "audio_hit": "games/sfx/memory-hit.wav",
+    "audio_miss": "games/sfx/memory-miss.wav",
+}
+
+
+class Manifest(object):
+    """
+    Serialized manifest of one board dimension together with its validators
+    """
+
+    def __init__(self, data, paths):
+        self.script = "var gameAssets = {};\n".format(json.dumps(data, sort_keys=True))
+        self.etag = hashlib.sha1(self.script.encode()).hexdigest()
+        self.last_modified = self.newest(paths)
+
+    @staticmethod
+    def newest(paths):
+        mtimes = []
+        for path in paths:
+            found = finders.find(path)
+            if found:
+                mtimes.append(os.path.getmtime(found))
+        if not mtimes:
+            return None
+        return datetime.datetime.fromtimestamp(int(max(mtimes)), tz=timezone.utc)
+
+
+@lru_cache(maxsize=64)
+def game_manifest(rows, columns):
+    """
+    The static game data for a board
+    :param rows: y rows
+    :param columns: x columns
+    :return: Manifest
+    :raise ValueError: for boards larger than MAX_SIDE, which are never cached
+    """
+    if not (0 < rows <= MAX_SIDE and 0 < columns <= MAX_SIDE):
+        raise ValueError(f"No manifest for a {rows}x{columns} board")
+    # Card ids index the pieces, boards with more pairs than there are images reuse them
+    pairs = (rows * columns) // 2
+    data = {
+        "name": "Memory",
+        "pieces": [static(PIECES[i % len(PIECES)]) for i in range(max(pairs, len(PIECES)))],
+        "font_family": "Press Start 2P",
+    }
+    data.update((key, static(path)) for key, path in FILES.items())
+    return Manifest(data, PIECES + list(FILES.values()))
+
+
+@receiver(setting_changed)
+def clear_manifests(setting, **kwargs):
+    if setting in ("STATIC_URL", "STATICFILES_STORAGE", "STATICFILES_DIRS"):
+        game_manifest.cache_clear()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite concurrency mode.
+
+configure_sqlite runs on every new SQLite connection. With settings.SQLITE_WAL it switches the database to write-ahead
+logging, where readers no longer block the writer and the writer no longer blocks readers, and sets synchronous=NORMAL
+which is safe with WAL and saves an fsync per commit. The busy timeout (DATABASES OPTIONS timeout) makes a writer wait
+for the lock instead of failing right away and CONN_MAX_AGE keeps the connections, and their settings, open.
+
+A busy timeout does not cover every case, a transaction which read before it writes can not wait for the lock and
+fails at once. retry_on_lock runs a write path again, with exponential backoff, when it fails on a locked database.
+"""
+import functools
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from gameness import metrics
+
+log = logging.getLogger(__name__)
+
+LOCK_RETRIES = metrics.Counter("gameness_db_lock_retries_total", "Write paths run again after a locked database",
+                               ("name",))
+metrics.METRICS += (LOCK_RETRIES,)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite" or not settings.SQLITE_WAL:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+
+
+def is_lock_error(error):
+    return isinstance(error, OperationalError) and "locked" in str(error)
+
+
+def retry_on_lock(function=None, on_retry=None):
+    """
+    Run the function again when it fails because the database is locked, at most settings.DB_LOCK_RETRIES times
+    with exponential backoff starting at settings.DB_LOCK_BACKOFF seconds. The function should do all its writes in
+    one transaction, so that a failed attempt leaves nothing behind. Inside an atomic block a retry is not possible,
+    the error is raised to the outermost retry_on_lock.
+    Can be used as a decorator, or called as retry_on_lock(function, on_retry=...)().
+    :param function: the write path
+    :param on_retry: called before every retry, for example to reload the objects the failed attempt changed
+    :return: the wrapped function
+    """
+    if function is None:
+        return functools.partial(retry_on_lock, on_retry=on_retry)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except OperationalError as e:
+                if not is_lock_error(e) or connection.in_atomic_block or attempt >= settings.DB_LOCK_RETRIES:
+                    raise
+            delay = settings.DB_LOCK_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+            attempt += 1
+            name = getattr(function, "__qualname__", repr(function))
+            log.info(f"Database is locked in {name}, retry {attempt} in {delay:.3f} s")
+            LOCK_RETRIES.inc(name=name)
+            time.sleep(delay)
+            if on_retry is not None:
+                on_retry()
+    return wrapper
+
+
+def atomic_retry(function, on_retry=None):
+    """
+    Run the function in a transaction, retried when the database is locked
+    :return: the result of the function
+    """
+    def run():
+        with transaction.atomic():
+            return function()
+    run.__qualname__ = getattr(function, "__qualname__", repr(function))
+    return retry_on_lock(run, on_retry=on_retry)()
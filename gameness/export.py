@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming export of the game history as CSV or JSON lines, used by ExportView and the export_data command.
+
+The rows are read with keyset pagination on the primary key, every batch is a separate query for the rows after the
+last exported id, so memory use does not depend on the size of the table and no cursor is held open while the
+client reads. gzip_stream compresses the output on the fly.
+"""
+import csv
+import datetime
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from gameness.models import Game, PlayerBest, SuspectedGame, Turn
+
+BATCH_SIZE = 2000
+
+DATASETS = {
+    "games": (Game, ("id", "player", "seed", "engine", "game_type", "created", "active", "finished", "score",
+                     "average_time", "turns_total", "turns_correct", "first_turn_at", "last_turn_at")),
+    "turns": (Turn, ("id", "game_id", "created", "is_match", "first_row", "first_column", "first_card", "second_row",
+                     "second_column", "second_card", "click_interval")),
+    "suspected": (SuspectedGame, ("id", "game_id", "player", "reason", "created")),
+    "leaderboard": (PlayerBest, ("id", "player", "score", "game_id", "achieved", "suspected_games", "disqualified")),
+}
+FORMATS = ("csv", "jsonl")
+CONTENT_TYPES = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson; charset=utf-8"}
+
+
+def rows(dataset, after=0, batch_size=BATCH_SIZE):
+    """
+    All rows of the dataset in primary key order
+    :param dataset: one of DATASETS
+    :param after: only rows with a larger primary key
+    :param batch_size: rows read per query
+    :return: iterator of value tuples in the order of the dataset fields
+    """
+    model, fields = DATASETS[dataset]
+    while True:
+        batch = list(model.objects.filter(pk__gt=after).order_by("pk").values_list(*fields)[:batch_size])
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        after = batch[-1][0]
+
+
+class Echo(object):
+    """
+    File-like object handing back what csv.writer writes
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(fields, values):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in values:
+        yield writer.writerow([csv_value(value) for value in row])
+
+
+def jsonl_lines(fields, values):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for row in values:
+        yield encoder.encode(dict(zip(fields, row))) + "\n"
+
+
+def lines(dataset, format, after=0, batch_size=BATCH_SIZE):
+    """
+    The dataset as lines of text in the given format
+    :param dataset: one of DATASETS
+    :param format: one of FORMATS
+    :return: iterator of str
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset: {dataset}")
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format: {format}")
+    fields = DATASETS[dataset][1]
+    values = rows(dataset, after, batch_size)
+    return csv_lines(fields, values) if format == "csv" else jsonl_lines(fields, values)
+
+
+def buffered(chunks, buffer_size=64 * 1024):
+    """
+    Join small text chunks, so that the server does not write every line separately
+    :param chunks: iterator of str
+    :return: iterator of bytes
+    """
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            yield "".join(buffer).encode()
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+def gzip_stream(chunks, level=6, buffer_size=64 * 1024):
+    """
+    Compress text chunks into a gzip stream on the fly
+    :param chunks: iterator of str
+    :param level: zlib compression level
+    :param buffer_size: bytes collected before they are handed to the compressor
+    :return: iterator of bytes
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            compressed = compressor.compress(b"".join(buffer))
+            buffer, size = [], 0
+            if compressed:
+                yield compressed
+    yield compressor.compress(b"".join(buffer)) + compressor.flush()
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Game state engines for ContestGameView, selected with settings.GAME_STATE_ENGINE.
+
+"session" keeps the pending first click in the session and writes every Turn to the database as soon as it has been
+played.
+
+"hybrid" writes every Turn right away as well, but keeps the pending first click in the settings.GAME_STATE_CACHE
+cache backend instead of the session. The session then only changes when a game starts or ends, so a click does not
+rewrite the session row. If the cached click is lost the next click starts a new turn.
+
+The cards of the pairs which have been found can not be clicked again, a game is completed when every pair has been
+found once. "session" reads them from the matching turns, "hybrid" and "cache" keep them with the cached state and
+only read the turns when it is lost.
+
+"cache" is write-behind. The pending click, the played turns and the turn counters of the active game are kept in the
+settings.GAME_STATE_CACHE cache backend and nothing is written while the game is played. The turns are flushed with
+one bulk_create and one Game update when the game completes, when the player starts another game, or by the
+flush_game_states command once the game has been idle. If the cached state is lost it is rebuilt from the Game row,
+turns which were not flushed yet are lost with it. A click and flush_game which loaded the same state never both
+write its turns, see CacheGameState.flush. Use a backend shared by all workers (file based or memcached) when
+running more than one process, the local memory backend is only seen by the process that wrote it.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from gameness import highscores, ranks
+from gameness.models import Game, PlayerBest, SuspectedGame, Turn
+
+log = logging.getLogger(__name__)
+
+ENGINE_SESSION = "session"
+ENGINE_HYBRID = "hybrid"
+ENGINE_CACHE = "cache"
+
+
+def state_cache():
+    return caches[settings.GAME_STATE_CACHE]
+
+
+class IllegalMove(ValueError):
+    pass
+
+
+class GameState(object):
+    """
+    Pending click and turns of one active game. Subclasses decide where they are stored.
+    """
+
+    def __init__(self, game, pending=None, pending_at=None, matched=None):
+        self.game = game
+        self.pending = pending # First click of the turn being played
+        self.pending_at = pending_at # time.time() of the first click
+        self.matched = matched # Card ids of the pairs found, None until load_matched has been called
+
+    def matched_cards(self):
+        """
+        :return: set of the card ids of the pairs which have been found
+        """
+        if self.matched is None:
+            self.matched = self.load_matched()
+        return self.matched
+
+    def load_matched(self):
+        """
+        Card ids of the pairs found in the turns written to the database
+        :return: set
+        """
+        return set(self.game.turns.filter(is_match=True, first_card__isnull=False).values_list("first_card", flat=True))
+
+    def unmatched_card(self, click):
+        """
+        :param click: {'row': 1, 'column': 1}
+        :return: card id of the clicked square
+        :raise IllegalMove: if the pair of the card has been found already
+        """
+        card = self.game.get_card_id(click)
+        if card in self.matched_cards():
+            raise IllegalMove(f"The card of a pair which has been found was clicked: {click}")
+        return card
+
+    def completed(self):
+        """
+        :return: True when every pair of the board has been found
+        """
+        return len(self.matched_cards()) >= self.game.pairs()
+
+    def play(self, click):
+        """
+        Evaluate one click
+        :param click: {'row': 1, 'column': 1}
+        :return: {'click': [<click with card>]} for the first click of a turn,
+                 {'click': [<click with card>, <click with card>], 'match': True/ False} for the second one
+        """
+        if self.pending is None:
+            click['card'] = self.unmatched_card(click)
+            self.pending = click
+            self.pending_at = time.time()
+            return {"click": [click]}
+
+        if (self.pending['row'], self.pending['column']) == (click['row'], click['column']):
+            raise IllegalMove(f"The same square was clicked twice: {click}")
+        self.unmatched_card(click)
+
+        move, is_match = self.game.match([self.pending, click])
+        click_interval = time.time() - self.pending_at if self.pending_at else None
+        self.pending = self.pending_at = None
+        if is_match:
+            self.matched_cards().add(move[0]['card'])
+        self.add_turn(move, is_match, click_interval)
+        return {"click": move, "match": is_match}
+
+    def add_turn(self, move, is_match, click_interval):
+        raise NotImplementedError
+
+    def save(self):
+        """
+        Store the state between two clicks
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """
+        Score the completed game, set it as finished and update the leaderboard and the cached highscores
+        :return:
+        """
+        game = self.game
+        game.score = game.calculate_score()
+        game.average_time = game.calculate_average_time()
+        game.set_finished()
+        self.save_finished()
+        new_best = PlayerBest.objects.record_game(game)
+        suspected = SuspectedGame.is_game_suspected(game)
+        # Only once the new score is visible: a top list read before the commit would be cached as the new version,
+        # and a rolled back click must not leave its score in the rank index
+        transaction.on_commit(lambda: highscores.game_finished(game, new_best, suspected))
+        transaction.on_commit(lambda: ranks.game_finished(game, new_best, suspected))
+
+    def save_finished(self):
+        """
+        Write the finished game. The state of the game may only be dropped once the transaction commits, a click which
+        is rolled back and run again on a locked database plays on the state it had before.
+        """
+        self.game.save(update_fields=["score", "average_time", "finished", "active"])
+
+
+class SessionGameState(GameState):
+    """
+    Pending click in the session, every turn is written to the database right away.
+    """
+
+    def __init__(self, game, session):
+        super(SessionGameState, self).__init__(game, session.get("click"), session.get("click_at"))
+        self.session = session
+
+    def add_turn(self, move, is_match, click_interval):
+        Turn.from_move(self.game, move, is_match, click_interval).save()
+
+    def save(self):
+        if self.pending is None:
+            self.session.pop("click", None)
+            self.session.pop("click_at", None)
+        else:
+            self.session["click"] = self.pending
+            self.session["click_at"] = self.pending_at
+
+    def save_finished(self):
+        def clear():
+            self.session.pop("click", None)
+            self.session.pop("click_at", None)
+        transaction.on_commit(clear)
+        super(SessionGameState, self).save_finished()
+
+
+class HybridGameState(SessionGameState):
+    """
+    Every turn is written to the database right away, the pending click is kept in a cache backend.
+    """
+
+    def __init__(self, game, session):
+        data = state_cache().get(self.cache_key(game.pk)) or {}
+        GameState.__init__(self, game, data.get("pending"), data.get("pending_at"), data.get("matched"))
+        self.session = session
+
+    @staticmethod
+    def cache_key(game_id):
+        return f"gameness:click:{game_id}"
+
+    def save(self):
+        state_cache().set(self.cache_key(self.game.pk),
+                          {"pending": self.pending, "pending_at": self.pending_at, "matched": self.matched},
+                          settings.GAME_STATE_TIMEOUT)
+
+    def save_finished(self):
+        key = self.cache_key(self.game.pk)
+        transaction.on_commit(lambda: state_cache().delete(key))
+        GameState.save_finished(self)
+
+
+class CacheGameState(GameState):
+    """
+    Write-behind state kept in a cache backend, see the module documentation.
+    """
+    COUNTERS = ("turns_total", "turns_correct", "first_turn_at", "last_turn_at")
+
+    def __init__(self, game, pending=None, pending_at=None, turns=None, touched=None, matched=None):
+        super(CacheGameState, self).__init__(game, pending, pending_at, matched)
+        self.turns = turns or [] # (created, move, is_match, click_interval) of the turns which have not been flushed
+        self.touched = touched or time.time()
+
+    @staticmethod
+    def cache_key(game_id):
+        return f"gameness:state:{game_id}"
+
+    @classmethod
+    def load(cls, game):
+        """
+        Get the cached state of the game, or rebuild it from the Game row if there is none
+        :param game: Game
+        :return: CacheGameState
+        """
+        data = state_cache().get(cls.cache_key(game.pk))
+        if data is None:
+            return cls(game)
+        for counter in cls.COUNTERS:
+            setattr(game, counter, data[counter])
+        return cls(game, data["pending"], data.get("pending_at"), data["turns"], data["touched"], data.get("matched"))
+
+    def load_matched(self):
+        matched = super(CacheGameState, self).load_matched()
+        matched.update(move[0]['card'] for created, move, is_match, click_interval in self.turns if is_match)
+        return matched
+
+    def add_turn(self, move, is_match, click_interval):
+        created = timezone.now()
+        self.turns.append((created, move, is_match, click_interval))
+        self.game.count_turn(created, is_match)
+
+    def save(self):
+        self.touched = time.time()
+        data = {"pending": self.pending, "pending_at": self.pending_at, "turns": self.turns, "touched": self.touched,
+                "matched": self.matched}
+        data.update((counter, getattr(self.game, counter)) for counter in self.COUNTERS)
+        state_cache().set(self.cache_key(self.game.pk), data, settings.GAME_STATE_TIMEOUT)
+
+    def flush(self, *fields):
+        """
+        Write the turns with one bulk_create and the counters, plus the given Game fields, with one update.
+        The update only applies while the Game row counts the turns which were written before the state was loaded.
+        When another request which loaded the same state flushed it first, the turns it wrote are the first ones of
+        this state and are dropped, the rest is written on top of them.
+        :param fields: extra Game fields to write
+        :return: True if the state has been written, False if another request wrote all of its turns
+        :raise IllegalMove: if the game can not be finished on the turns in the database
+        """
+        game = self.game
+        values = dict((field, getattr(game, field)) for field in self.COUNTERS + fields)
+        with transaction.atomic():
+            written = game.turns_total - len(self.turns) # Turns in the database when the state was loaded
+            updated = Game.objects.filter(pk=game.pk, turns_total=written).update(**values)
+            if not updated:
+                total = Game.objects.filter(pk=game.pk).values_list("turns_total", flat=True).first()
+                flushed = (total or 0) - written
+                if 0 < flushed < len(self.turns):
+                    del self.turns[:flushed]
+                    updated = Game.objects.filter(pk=game.pk, turns_total=total).update(**values)
+            if not updated:
+                if fields:
+                    raise IllegalMove(f"The turns of game {game.pk} do not match the database")
+                return False
+            Turn.objects.bulk_create(
+                [Turn.from_move(game, move, is_match, click_interval, created=created)
+                 for created, move, is_match, click_interval in self.turns])
+        self.turns = []
+        key = self.cache_key(game.pk)
+        # Inside the transaction of a click, the cached turns are all there is until the turns commit
+        transaction.on_commit(lambda: state_cache().delete(key))
+        return True
+
+    def save_finished(self):
+        self.flush("score", "average_time", "finished", "active")
+
+
+def load(request, game):
+    """
+    Get the state of the active game with the engine in settings.GAME_STATE_ENGINE
+    :param request:
+    :param game: active Game
+    :return: GameState
+    """
+    if settings.GAME_STATE_ENGINE == ENGINE_CACHE:
+        return CacheGameState.load(game)
+    if settings.GAME_STATE_ENGINE == ENGINE_HYBRID:
+        return HybridGameState(game, request.session)
+    return SessionGameState(game, request.session)
+
+
+def flush_game(game_id, idle=0):
+    """
+    Flush the write-behind state of a game which is no longer being played
+    :param game_id:
+    :param idle: only flush when nothing has been played for this many seconds
+    :return: True if the state has been flushed by this call
+    """
+    if settings.GAME_STATE_ENGINE != ENGINE_CACHE:
+        return False
+    data = state_cache().get(CacheGameState.cache_key(game_id))
+    if data is None or time.time() - data["touched"] < idle:
+        return False
+    try:
+        game = Game.objects.get(pk=game_id)
+    except Game.DoesNotExist:
+        log.warning(f"Dropping cached state of game {game_id}, the game does not exist.")
+        state_cache().delete(CacheGameState.cache_key(game_id))
+        return False
+    return CacheGameState.load(game).flush()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Cached top list of ContestHighscoreView, the same for every player.
+
+The table is stored under a versioned key in the settings.HIGHSCORE_CACHE backend, rendering it costs a read of the
+version and a read of the table. game_finished bumps the version when a finished game can change the table: a new
+personal best which scores at least as much as the last entry, or a suspected game of a player on the table who may
+just have been disqualified. Tables of old versions are never read again and expire.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from gameness.models import Game
+
+VERSION_KEY = "gameness:highscores:version"
+
+
+def highscore_cache():
+    return caches[settings.HIGHSCORE_CACHE]
+
+
+def table_key(version):
+    return f"gameness:highscores:{version}:{settings.HIGHSCORE_SIZE}"
+
+
+def current_version():
+    cache = highscore_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock, so that a version key lost to eviction does not point at an old table again
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    cache = highscore_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+
+
+def get_unique_highscores():
+    """
+    The best game of the settings.HIGHSCORE_SIZE best players, from the cache if possible
+    :return: list of {'id', 'player', 'score', 'created'}
+    """
+    cache = highscore_cache()
+    key = table_key(current_version())
+    table = cache.get(key)
+    if table is None:
+        games, _ = Game.objects.get_unique_highscores(settings.HIGHSCORE_SIZE)
+        table = [{"id": game.id, "player": game.player, "score": game.score, "created": game.created}
+                 for game in games]
+        cache.set(key, table, settings.HIGHSCORE_CACHE_TIMEOUT)
+    return table
+
+
+def game_finished(game, new_best, suspected):
+    """
+    Bump the version if the finished game can change the cached table
+    :param game: finished Game
+    :param new_best: the game is the new personal best of the player, see PlayerBestManager.record_game
+    :param suspected: a SuspectedGame was recorded for the game
+    :return: True if the version was bumped
+    """
+    table = highscore_cache().get(table_key(current_version()))
+    if table is None:
+        # A request may be reading the table from the database right now, make sure it is not cached as current
+        changed = True
+    else:
+        full = len(table) >= settings.HIGHSCORE_SIZE
+        changed = (new_best and (not full or game.score >= table[-1]["score"])) or \
+                  (suspected and any(row["player"] == game.player for row in table))
+    if changed:
+        bump_version()
+    return changed
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Keyset pagination of the full leaderboard, used by ContestLeaderboardView.
+
+Both modes are ordered by score, highest first, and by id, lowest first, so tied scores keep a stable order. A page
+does not skip rows with OFFSET, it continues after the (score, id) of the last row of the previous page, which the
+client gets back as an opaque cursor. The continuation is read with two index seeks, the rows tied with the cursor
+score after its id and then the lower scores, so every page costs the same however deep it is. Both orders follow
+their index (gameness_game_highscores and gameness_playerbest_rank, which end with the implicit rowid).
+"""
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+
+from gameness.models import Game, PlayerBest
+
+MAX_ID = 2 ** 63 - 1 # Largest SQLite INTEGER, the ids of a cursor are compared with the id column
+
+MODES = {
+    # mode: (queryset, fields)
+    "games": (lambda: Game.objects.get_highscores(), ("id", "player", "score", "created")),
+    "players": (lambda: PlayerBest.objects.filter(disqualified=False, game__isnull=False),
+                ("id", "player", "score", "game_id", "achieved")),
+}
+
+
+def encode_cursor(mode, score, pk):
+    data = json.dumps([mode, str(score), pk], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(mode, cursor):
+    """
+    :return: (score, id) of the last row of the previous page
+    :raise ValueError: if the cursor is not one of this mode
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+        cursor_mode, score, pk = data
+        score, pk = Decimal(score), int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError, InvalidOperation):
+        raise ValueError("Invalid cursor")
+    if cursor_mode != mode or not score.is_finite() or not 0 <= pk <= MAX_ID:
+        raise ValueError("Invalid cursor")
+    return score, pk
+
+
+def page(mode, cursor=None, size=25):
+    """
+    One page of the leaderboard
+    :param mode: one of MODES, "games" lists every finished game, "players" the best game of every player
+    :param cursor: the next cursor of the previous page, None for the first page
+    :param size: rows per page
+    :return: (list of row dicts, cursor of the next page or None on the last page)
+    """
+    queryset, fields = MODES[mode]
+    queryset = queryset().values(*fields)
+    if cursor is None:
+        rows = list(queryset.order_by("-score", "id")[:size + 1])
+    else:
+        score, pk = decode_cursor(mode, cursor)
+        rows = list(queryset.filter(score=score, id__gt=pk).order_by("id")[:size + 1])
+        if len(rows) <= size:
+            rows += list(queryset.filter(score__lt=score).order_by("-score", "id")[:size + 1 - len(rows)])
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, encode_cursor(mode, rows[-1]["score"], rows[-1]["id"])
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous logging. configure is set as LOGGING_CONFIG, it applies settings.LOGGING and then moves the handlers of
+the loggers in settings.LOGGING_ASYNC_LOGGERS behind a queue. The request threads only put the record on the queue,
+formatting and writing it happens on a QueueListener thread.
+
+SampleFilter and RateLimitFilter cut down the high frequency messages before they are queued, see the filters in
+settings.LOGGING.
+
+The queued records are written when the process exits. A gunicorn worker exits normally on a graceful shutdown so the
+atexit hook covers it, worker_exit can also be set as the gunicorn server hook of the same name. The listener threads
+are restarted in forked children, so --preload works as well.
+"""
+import atexit
+import logging
+import logging.config
+import os
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+
+from django.conf import settings
+
+_listeners = [] # (AsyncQueueHandler, QueueListener) of every logger moved behind a queue
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Queues the record as it is, the listener thread formats it. Nothing is pickled since the queue is in-process, so
+    unlike QueueHandler the message is not merged with its arguments on the calling thread. When the queue is full the
+    record is dropped rather than blocking the request, the number of dropped records is logged once there is room.
+    """
+
+    def __init__(self, queue):
+        super(AsyncQueueHandler, self).__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            self.enqueue(logging.makeLogRecord({
+                "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"Dropped {dropped} log records, the log queue was full."}))
+
+
+class SampleFilter(logging.Filter):
+    """
+    Lets a random share of the records up to max_level through, records above max_level always pass
+    """
+
+    def __init__(self, rate=0.1, max_level=logging.INFO):
+        super(SampleFilter, self).__init__()
+        self.rate = rate
+        self.max_level = max_level if isinstance(max_level, int) else logging.getLevelName(max_level)
+
+    def filter(self, record):
+        return record.levelno > self.max_level or random.random() < self.rate
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most rate records per period seconds through from every line that logs. The first record let through
+    in a new period tells how many were suppressed in the previous one.
+    """
+
+    def __init__(self, rate=10, per=60.0):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.per = per
+        self._windows = {} # (pathname, lineno) -> [start of the period, records passed, records suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.per:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.rate:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+def configure(config):
+    """
+    LOGGING_CONFIG callable, dictConfig followed by moving the handlers of settings.LOGGING_ASYNC_LOGGERS to a
+    QueueListener
+    :param config: settings.LOGGING
+    :return:
+    """
+    stop()
+    logging.config.dictConfig(config)
+    for name in settings.LOGGING_ASYNC_LOGGERS:
+        logger = logging.getLogger(name)
+        handlers = list(logger.handlers)
+        if not handlers:
+            continue
+        queue = Queue(settings.LOGGING_QUEUE_SIZE)
+        handler = AsyncQueueHandler(queue)
+        listener = QueueListener(queue, *handlers, respect_handler_level=True)
+        for target in handlers:
+            logger.removeHandler(target)
+        logger.addHandler(handler)
+        listener.start()
+        _listeners.append((handler, listener))
+
+
+def stop():
+    """
+    Write the queued records and stop the listener threads, the loggers keep queueing but nothing is written anymore
+    """
+    while _listeners:
+        handler, listener = _listeners.pop()
+        listener.stop()
+        for target in listener.handlers:
+            target.flush()
+
+
+def worker_exit(server, worker):
+    """
+    gunicorn server hook, write the queued records before the worker exits
+    """
+    stop()
+
+
+def _restart_after_fork():
+    # The listener thread does not survive a fork and the queue lock may have been held, start over with a new queue
+    for handler, listener in _listeners:
+        handler.queue = listener.queue = Queue(listener.queue.maxsize)
+        listener.start()
+
+
+atexit.register(stop)
+os.register_at_fork(after_in_child=_restart_after_fork)
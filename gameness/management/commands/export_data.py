@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import gzip
+
+from django.core.management.base import BaseCommand
+
+from gameness import export
+
+
+class Command(BaseCommand):
+    help = "Export a dataset as CSV or JSON lines with constant memory. Output files ending in .gz are gzip compressed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", choices=sorted(export.DATASETS))
+        parser.add_argument("--format", choices=export.FORMATS, default="csv")
+        parser.add_argument("--output", help="File to write, standard output if not given")
+        parser.add_argument("--gzip", action="store_true", help="Compress the output even if it does not end in .gz")
+        parser.add_argument("--after", type=int, default=0, help="Only export rows after this id, to resume an export")
+        parser.add_argument("--batch-size", type=int, default=export.BATCH_SIZE, help="Rows read per query")
+
+    def handle(self, *args, **options):
+        lines = export.lines(options["dataset"], options["format"], after=options["after"],
+                             batch_size=options["batch_size"])
+        if not options["output"]:
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+
+        if options["gzip"] or options["output"].endswith(".gz"):
+            output = gzip.open(options["output"], "wt", encoding="utf-8", newline="")
+        else:
+            output = open(options["output"], "w", encoding="utf-8", newline="")
+        count = 0
+        with output:
+            for line in lines:
+                output.write(line)
+                count += 1
+        if options["format"] == "csv":
+            count -= 1 # The header
+        self.stdout.write(f"Exported {count} {options['dataset']} to {options['output']}.")
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from gameness import gamestate
+from gameness.models import Game
+
+
+class Command(BaseCommand):
+    help = "Write the cached state of idle games to the database when GAME_STATE_ENGINE is \"cache\"."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--idle", type=int, default=settings.GAME_STATE_IDLE,
+                            help="Seconds without clicks before a game is flushed")
+        parser.add_argument("--max-age", type=int, default=settings.GAME_STATE_TIMEOUT,
+                            help="Only look at unfinished games created during the last seconds")
+
+    def handle(self, *args, **options):
+        if settings.GAME_STATE_ENGINE != gamestate.ENGINE_CACHE:
+            self.stdout.write("GAME_STATE_ENGINE is not \"cache\", nothing to flush.")
+            return
+
+        since = timezone.now() - datetime.timedelta(seconds=options["max_age"])
+        game_ids = Game.objects.filter(finished=False, created__gte=since).values_list("pk", flat=True)
+        flushed = sum(gamestate.flush_game(game_id, idle=options["idle"]) for game_id in game_ids.iterator())
+        self.stdout.write(f"Flushed {flushed} idle games.")
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+import http.cookiejar
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.signals import got_request_exception
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+from django.urls import reverse
+
+ENDPOINTS = (("contest_contest", "contest"), ("contest_game_view", "api"), ("contest_highscore", "highscore"))
+
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile of an unsorted list
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, int(round(percent / 100.0 * len(values))) - 1)]
+
+
+class Stats(object):
+    """
+    Thread safe collection of the measurements, per endpoint
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = dict((name, []) for url, name in ENDPOINTS)
+        self.queries = dict((name, 0) for url, name in ENDPOINTS)
+        self.statuses = {}
+        self.lock_errors = 0
+        self.errors = []
+        self.games = 0
+
+    def request(self, endpoint, status, seconds):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def query(self, endpoint):
+        with self.lock:
+            self.queries[endpoint] += 1
+
+    def error(self, message):
+        with self.lock:
+            self.errors.append(message)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class InstrumentedApplication(object):
+    """
+    WSGI application counting the ORM queries of every request, per endpoint
+    """
+
+    def __init__(self, stats, paths):
+        self.stats = stats
+        self.paths = paths
+        self.application = WSGIHandler()
+
+    def __call__(self, environ, start_response):
+        endpoint = self.paths.get(environ.get("PATH_INFO"))
+
+        def count(execute, sql, params, many, context):
+            if endpoint:
+                self.stats.query(endpoint)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            return self.application(environ, start_response)
+
+
+class Player(object):
+    """
+    Simulated player, remembers every card it has seen and plays known pairs first
+    """
+
+    def __init__(self, base_url, paths, stats, think_time):
+        self.base_url = base_url
+        self.paths = paths
+        self.stats = stats
+        self.think_time = think_time
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.csrf_token = None
+
+    def request(self, url, data=None):
+        endpoint = self.paths[url]
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        start_time = time.perf_counter()
+        try:
+            with self.opener.open(self.base_url + url, body, timeout=60) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, content = e.code, e.read()
+        self.stats.request(endpoint, status, time.perf_counter() - start_time)
+        if status != 200:
+            raise ValueError(f"{endpoint} returned {status}: {content[:200].decode(errors='replace')}")
+        return content.decode()
+
+    def click(self, square):
+        if self.think_time:
+            time.sleep(random.uniform(0.5, 1.5) * self.think_time)
+        row, column = square
+        response = json.loads(self.request(reverse("contest_game_view"), {
+            "csrfmiddlewaretoken": self.csrf_token,
+            "click": json.dumps({"row": row, "column": column}),
+        }))
+        self.csrf_token = response.get("csrf_token", self.csrf_token)
+        self.known[square] = response["click"][-1]["card"]
+        return response
+
+    def known_pair(self):
+        squares = {}
+        for square, card in self.known.items():
+            if square not in self.matched:
+                squares.setdefault(card, []).append(square)
+        for pair in squares.values():
+            if len(pair) == 2:
+                return pair
+        return None
+
+    def play_game(self):
+        page = self.request(reverse("contest_contest"))
+        game_data = json.loads(re.search(r"var gameData = (\{.*?\});", page).group(1))
+        self.csrf_token = re.search(r'gameData.csrfToken = "([^"]+)"', page).group(1)
+
+        self.known = {}
+        self.matched = set()
+        unknown = [(row, column) for row in range(game_data["rows"]) for column in range(game_data["cols"])]
+        random.shuffle(unknown)
+
+        completed = False
+        while not completed:
+            pair = self.known_pair()
+            if pair is None and not unknown:
+                raise ValueError("Ran out of squares before the game was completed")
+            first = pair[0] if pair else unknown.pop()
+            card = self.click(first)["click"][-1]["card"]
+            if pair:
+                second = pair[1]
+            else:
+                partners = [square for square, known in self.known.items()
+                            if known == card and square != first and square not in self.matched]
+                second = partners[0] if partners else unknown.pop()
+            response = self.click(second)
+            if response.get("match"):
+                self.matched.update((first, second))
+            completed = response.get("completed", False)
+
+        self.request(reverse("contest_highscore"))
+        with self.stats.lock:
+            self.stats.games += 1
+
+    def play(self, games):
+        for game in range(games):
+            try:
+                self.play_game()
+            except Exception as e:
+                self.stats.error(f"{type(e).__name__}: {e}")
+
+
+class Command(BaseCommand):
+    help = "Load test the game: simulated players play complete games in parallel threads against a local WSGI " \
+           "server (or --url) and the throughput and latency per endpoint is reported. The local server uses the " \
+           "configured database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--players", type=int, default=10, help="Number of simulated players")
+        parser.add_argument("--games", type=int, default=5, help="Games played by every player")
+        parser.add_argument("--think-time", type=float, default=0.0,
+                            help="Average seconds between two clicks, 0 clicks as fast as possible")
+        parser.add_argument("--url", help="Run against an already running server instead of starting one, for "
+                                          "example http://127.0.0.1:8000. Queries and lock errors are not counted")
+
+    def handle(self, *args, **options):
+        if options["players"] < 1 or options["games"] < 1:
+            raise CommandError("--players and --games must be at least 1")
+
+        stats = Stats()
+        paths = dict((reverse(url), name) for url, name in ENDPOINTS)
+
+        if options["url"]:
+            elapsed = self.run_players(options["url"].rstrip("/"), paths, stats, options)
+            self.report(stats, elapsed, count_queries=False)
+            return
+
+        def lock_error(sender, **kwargs):
+            error = sys.exc_info()[1]
+            if isinstance(error, OperationalError) and "locked" in str(error):
+                with stats.lock:
+                    stats.lock_errors += 1
+
+        # ContestView picks a random address from USER_EMAILS for every game and stops the active games of that
+        # address, give the simulated players enough addresses to not stop each others games.
+        emails = [f"loadtest-{i}@email.com" for i in range(options["players"] * options["games"] * 100)]
+        with override_settings(ALLOWED_HOSTS=["127.0.0.1"], USER_EMAILS=emails):
+            server = ThreadedWSGIServer(("127.0.0.1", 0), QuietRequestHandler)
+            server.set_app(InstrumentedApplication(stats, paths))
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            got_request_exception.connect(lock_error)
+            try:
+                elapsed = self.run_players(f"http://127.0.0.1:{server.server_port}", paths, stats, options)
+            finally:
+                got_request_exception.disconnect(lock_error)
+                server.shutdown()
+                server.server_close()
+        self.report(stats, elapsed, count_queries=True)
+
+    def run_players(self, base_url, paths, stats, options):
+        self.stdout.write(f"{options['players']} players playing {options['games']} games each against {base_url}")
+        players = [Player(base_url, paths, stats, options["think_time"]) for i in range(options["players"])]
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(players)) as executor:
+            for player in players:
+                executor.submit(player.play, options["games"])
+        return time.perf_counter() - start_time
+
+    def report(self, stats, elapsed, count_queries):
+        requests = sum(len(latencies) for latencies in stats.latencies.values())
+        self.stdout.write(f"{stats.games} games and {requests} requests in {elapsed:.2f} s, "
+                          f"{requests / elapsed:.1f} requests/s, {stats.games / elapsed:.2f} games/s")
+        self.stdout.write(f"{'endpoint':>10} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                          f"{'queries/req':>12}")
+        for endpoint, latencies in stats.latencies.items():
+            queries = f"{stats.queries[endpoint] / len(latencies):12.1f}" if count_queries and latencies else \
+                f"{'-':>12}"
+            self.stdout.write(f"{endpoint:>10} {len(latencies):>9} {len(latencies) / elapsed:8.1f} "
+                              f"{percentile(latencies, 50) * 1000:8.1f} {percentile(latencies, 95) * 1000:8.1f} "
+                              f"{percentile(latencies, 99) * 1000:8.1f} {queries}")
+        self.stdout.write(f"Responses: {', '.join(f'{status}: {count}' for status, count in sorted(stats.statuses.items()))}")
+        if count_queries:
+            self.stdout.write(f"Database lock errors: {stats.lock_errors}")
+        if stats.errors:
+            self.stdout.write(f"Failed games: {len(stats.errors)}, first error: {stats.errors[0]}")
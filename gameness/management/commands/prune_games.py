@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from gameness import retention
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned games and archive finished games older than GAME_RETENTION_DAYS to a compressed file " \
+           "before deleting them, in small batches. Suspected games and the games of the leaderboard are kept."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--archive-dir", default=settings.GAME_ARCHIVE_DIR, help="Directory for the archive files")
+        parser.add_argument("--no-archive", action="store_true", help="Only delete the abandoned games")
+        parser.add_argument("--batch-size", type=int, default=retention.BATCH_SIZE, help="Games per transaction")
+        parser.add_argument("--pause", type=float, default=0.1,
+                            help="Seconds to sleep between the batches, so that other requests get the database")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the games which would be pruned")
+
+    def handle(self, *args, **options):
+        if not 0 < options["batch_size"] <= 500:
+            raise CommandError("--batch-size must be between 1 and 500")
+        now = timezone.now()
+
+        if options["dry_run"]:
+            self.stdout.write(f"{retention.abandoned_games(now).count()} abandoned games would be deleted.")
+            if not options["no_archive"]:
+                self.stdout.write(f"{retention.expired_games(now).count()} finished games would be archived.")
+            return
+
+        deleted = retention.prune_abandoned(options["batch_size"], options["pause"], now)
+        self.stdout.write(f"Deleted {deleted} abandoned games.")
+        if not options["no_archive"]:
+            path = retention.archive_path(options["archive_dir"], now)
+            archived = retention.archive_expired(path, options["batch_size"], options["pause"], now)
+            self.stdout.write(f"Archived {archived} finished games to {path}." if archived else
+                              "No finished games to archive.")
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gameness import db, highscores, replay
+from gameness.models import Game, PlayerBest, SuspectedGame, Turn
+
+REASON = "Replay verification failed" # Start of the reason of the SuspectedGame records made by this command
+
+
+class Command(BaseCommand):
+    help = "Replay finished games from their seed and turns, the board, every match and the score are calculated " \
+           "again. Games which do not verify are flagged as SuspectedGame. The games are streamed in chunks which are " \
+           "verified in a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="Worker processes, 1 verifies in this process")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Games read and verified together")
+        parser.add_argument("--from-id", type=int, default=0, help="Start from this game id, to resume a run")
+        parser.add_argument("--tolerance", type=Decimal, default=Decimal("0.01"),
+                            help="Largest accepted difference between the stored and the replayed score")
+        parser.add_argument("--dry-run", action="store_true", help="Only report the games which do not verify")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["chunk_size"] < 1:
+            raise CommandError("--workers and --chunk-size must be at least 1")
+
+        self.options = options
+        self.flagged = set(SuspectedGame.objects.filter(reason__startswith=REASON).values_list("game_id", flat=True))
+        verified = failed = 0
+        start_time = time.perf_counter()
+
+        chunks = self.chunks(options["from_id"], options["chunk_size"])
+        if options["workers"] == 1:
+            results = ((len(chunk), replay.verify_chunk(chunk, options["tolerance"])) for chunk in chunks)
+            failed, verified = self.process(results)
+        else:
+            with ProcessPoolExecutor(options["workers"], initializer=replay.setup_worker) as executor:
+                failed, verified = self.process(self.verify_parallel(executor, chunks))
+
+        seconds = time.perf_counter() - start_time
+        self.stdout.write(f"Verified {verified} games in {seconds:.1f} s, {failed} did not verify.")
+
+    def chunks(self, from_id, chunk_size):
+        """
+        Stream the finished games in id order together with their turns
+        :return: iterator of lists of (game, turns), see replay.verify_game
+        """
+        games = Game.objects.filter(finished=True, pk__gte=from_id).order_by("pk").values(*replay.GAME_FIELDS)
+        chunk = []
+        for game in games.iterator(chunk_size=chunk_size):
+            game["board_data"] = bytes(game["board_data"])
+            chunk.append(game)
+            if len(chunk) >= chunk_size:
+                yield self.with_turns(chunk)
+                chunk = []
+        if chunk:
+            yield self.with_turns(chunk)
+
+    def with_turns(self, games):
+        # One query for the turns of the whole chunk, by id range as the chunk may hold more ids than an IN clause
+        turns = dict((game["id"], []) for game in games)
+        for turn in Turn.objects.filter(game_id__gte=games[0]["id"], game_id__lte=games[-1]["id"]).order_by(
+                "game_id", "created", "pk").values(*replay.TURN_FIELDS).iterator():
+            if turn["game_id"] in turns:
+                turns[turn["game_id"]].append(turn)
+        return [(game, turns[game["id"]]) for game in games]
+
+    def verify_parallel(self, executor, chunks):
+        """
+        Verify the chunks in the process pool, with a bounded number of chunks in flight so that the games are not
+        all read into memory ahead of the workers
+        :return: iterator of (number of games, failed games) in the order of the chunks
+        """
+        pending = deque()
+        for chunk in chunks:
+            pending.append((len(chunk), executor.submit(replay.verify_chunk, chunk, self.options["tolerance"])))
+            if len(pending) >= self.options["workers"] * 2:
+                size, future = pending.popleft()
+                yield size, future.result()
+        while pending:
+            size, future = pending.popleft()
+            yield size, future.result()
+
+    def process(self, results):
+        """
+        Report and flag the failed games of every verified chunk
+        :return: (failed games, verified games)
+        """
+        failed = verified = 0
+        for size, games in results:
+            verified += size
+            failed += len(games)
+            for game_id, player, reasons in games:
+                self.stdout.write(f"Game {game_id} by {player}: {'; '.join(reasons)}")
+            if not self.options["dry_run"]:
+                self.flag(games)
+            if self.options["verbosity"] > 1:
+                self.stdout.write(f"Verified {verified} games, {failed} did not verify.")
+        return failed, verified
+
+    def flag(self, games):
+        games = [(game_id, player, reasons) for game_id, player, reasons in games if game_id not in self.flagged]
+        if not games:
+            return
+
+        def record():
+            # The records and the suspected games counters of the players change together
+            SuspectedGame.objects.bulk_create(
+                [SuspectedGame(game_id=game_id, player=player,
+                               reason=f"{REASON} for the round {game_id} by {player}: {'; '.join(reasons)}.")
+                 for game_id, player, reasons in games])
+            for game_id, player, reasons in games:
+                PlayerBest.objects.record_suspected_game(player)
+
+        db.atomic_retry(record)
+        self.flagged.update(game_id for game_id, player, reasons in games)
+        highscores.bump_version()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Process local request metrics, exposed in the Prometheus text format by metrics_view to staff members and to the
+scrapers in settings.METRICS_ALLOWED_IPS.
+
+MetricsMiddleware records the latency of every request per view, the number and the time of its ORM queries and the
+time spent saving the session. timer and timed record named sections of code, such as the scoring and the leaderboard
+queries, in one histogram labelled by name. Recording is a perf_counter call, a bisect and a locked increment, cheap
+enough to stay on in production.
+
+The metrics live in the memory of the process, with several gunicorn workers every worker reports its own numbers and
+Prometheus sums them up.
+"""
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connection
+from django.http import HttpResponse
+
+# Seconds, from 100 microseconds for the model methods up to 10 seconds for slow requests
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """
+    A metric with a value per combination of label values
+    """
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self):
+        """
+        :return: list of (name suffix, labels, value)
+        """
+        with self._lock:
+            return [("", dict(zip(self.labels, key)), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{self.name}{suffix}{format_labels(labels)} {format_value(value)}"
+                     for suffix, labels, value in self.samples())
+        return "\n".join(lines)
+
+    def set(self, value, **labels):
+        """
+        Replace the value, for gauges and for counters kept elsewhere which are copied when rendering
+        """
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Observations per bucket, the last one is +Inf, followed by the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        samples = []
+        for key, counts in values:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", dict(labels, le=format_value(float(bound))), cumulative))
+            samples.append(("_sum", labels, counts[-1]))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+REQUEST_DURATION = Histogram("gameness_request_duration_seconds", "Time spent handling the request", ("view", "method"))
+REQUESTS = Counter("gameness_requests_total", "Handled requests", ("view", "method", "status"))
+DB_QUERIES = Counter("gameness_db_queries_total", "ORM queries issued by the requests", ("view",))
+DB_QUERY_SECONDS = Counter("gameness_db_query_seconds_total", "Time spent in ORM queries by the requests", ("view",))
+SESSION_SAVE = Histogram("gameness_session_save_seconds", "Time spent saving the session", ("view",))
+TIMERS = Histogram("gameness_timer_seconds", "Named sections of code, see gameness.metrics.timer", ("name",))
+POOL_BOARDS = Counter("gameness_playfield_pool_boards_total", "Boards asked from the playfield pool", ("result",))
+POOL_READY = Gauge("gameness_playfield_pool_ready", "Boards ready in the playfield pool", ("dimensions",))
+BOARD_CACHE_SIZE = Gauge("gameness_board_cache_boards", "Parsed boards in the board cache")
+
+METRICS = (REQUEST_DURATION, REQUESTS, DB_QUERIES, DB_QUERY_SECONDS, SESSION_SAVE, TIMERS, POOL_BOARDS, POOL_READY,
+           BOARD_CACHE_SIZE)
+
+
+@contextmanager
+def timer(name):
+    """
+    Record the time the block takes in gameness_timer_seconds
+    :param name: label of the timed section
+    """
+    with TIMERS.time(name=name):
+        yield
+
+
+def timed(name):
+    """
+    Decorator recording every call of the function in gameness_timer_seconds
+    :param name: label of the timed section
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                TIMERS.observe(time.perf_counter() - start_time, name=name)
+        return wrapper
+    return decorator
+
+
+def collect_playfields():
+    """
+    Copy the state of the playfield pool and the board cache into their metrics
+    """
+    from gameness.models import board_cache
+    from gameness.pool import playfield_pool
+
+    stats = playfield_pool.stats()
+    POOL_BOARDS.set(stats["hits"], result="hit")
+    POOL_BOARDS.set(stats["misses"], result="miss")
+    for dimensions, ready in stats["ready"].items():
+        POOL_READY.set(ready, dimensions=dimensions)
+    BOARD_CACHE_SIZE.set(len(board_cache))
+
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format
+    :return: str
+    """
+    collect_playfields()
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
+
+
+def metrics_response(request):
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
+
+
+def metrics_view(request):
+    """
+    Staff only, like the data export, except for the addresses in settings.METRICS_ALLOWED_IPS
+    """
+    if request.META.get("REMOTE_ADDR") in settings.METRICS_ALLOWED_IPS:
+        return metrics_response(request)
+    return staff_member_required(metrics_response)(request)
+
+
+class QueryRecorder(object):
+    """
+    connection.execute_wrapper counting the queries of one request and the time they take
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start_time
+            self.count += 1
+
+
+class MetricsMiddleware(object):
+    """
+    Records the request metrics, put it first in MIDDLEWARE so the time of the other middleware is included.
+    Requests which do not resolve to a view are labelled "unresolved".
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryRecorder()
+        start_time = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start_time
+
+        view = self.view_name(request)
+        REQUEST_DURATION.observe(duration, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        DB_QUERIES.inc(queries.count, view=view)
+        DB_QUERY_SECONDS.inc(queries.seconds, view=view)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # The session is saved by SessionMiddleware on the way out, time it by wrapping the save of this request
+        session = getattr(request, "session", None)
+        if session is not None:
+            save = session.save
+
+            def timed_save(*args, **kwargs):
+                with SESSION_SAVE.time(view=self.view_name(request)):
+                    return save(*args, **kwargs)
+            session.save = timed_save
+
+    @staticmethod
+    def view_name(request):
+        resolver_match = getattr(request, "resolver_match", None)
+        return resolver_match.url_name or resolver_match.view_name if resolver_match else "unresolved"
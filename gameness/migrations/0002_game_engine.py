@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameness', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='engine',
+            field=models.CharField(choices=[('legacy', 'Legacy (rejection sampling)'), ('shuffle', 'Shuffle')], default='legacy', max_length=16, verbose_name='Playfield engine'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q
+
+CHUNK_SIZE = 500
+
+
+def backfill_turn_counters(apps, schema_editor):
+    """
+    Count the turns of every existing game, written back in chunks
+    """
+    Game = apps.get_model('gameness', 'Game')
+    Turn = apps.get_model('gameness', 'Turn')
+    fields = ['turns_total', 'turns_correct', 'first_turn_at', 'last_turn_at']
+
+    stats = Turn.objects.values('game_id').annotate(
+        total=Count('id'),
+        correct=Count('id', filter=Q(is_match=True)),
+        first=Min('created'),
+        last=Max('created'),
+    ).order_by('game_id')
+
+    games = []
+    for row in stats.iterator(chunk_size=CHUNK_SIZE):
+        games.append(Game(pk=row['game_id'], turns_total=row['total'], turns_correct=row['correct'],
+                          first_turn_at=row['first'], last_turn_at=row['last']))
+        if len(games) >= CHUNK_SIZE:
+            Game.objects.bulk_update(games, fields)
+            games = []
+    if games:
+        Game.objects.bulk_update(games, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameness', '0002_game_engine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='first_turn_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='First turn'),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='last_turn_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last turn'),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='turns_correct',
+            field=models.PositiveIntegerField(default=0, verbose_name='Matching turns'),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='turns_total',
+            field=models.PositiveIntegerField(default=0, verbose_name='Turns'),
+        ),
+        migrations.RunPython(backfill_turn_counters, migrations.RunPython.noop),
+    ]
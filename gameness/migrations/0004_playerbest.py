@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+CHUNK_SIZE = 500
+
+
+def backfill_player_best(apps, schema_editor):
+    """
+    Fill the leaderboard with the best finished game of every player
+    """
+    Game = apps.get_model('gameness', 'Game')
+    PlayerBest = apps.get_model('gameness', 'PlayerBest')
+
+    games = Game.objects.filter(active=False, finished=True).order_by('player', '-score', 'id').values(
+        'id', 'player', 'score', 'created')
+
+    bests = []
+    player = None
+    for game in games.iterator(chunk_size=CHUNK_SIZE):
+        if game['player'] == player:
+            continue
+        player = game['player']
+        bests.append(PlayerBest(player=player, score=game['score'], game_id=game['id'], achieved=game['created']))
+        if len(bests) >= CHUNK_SIZE:
+            PlayerBest.objects.bulk_create(bests)
+            bests = []
+    if bests:
+        PlayerBest.objects.bulk_create(bests)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameness', '0003_game_turn_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerBest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('player', models.EmailField(max_length=254, unique=True)),
+                ('score', models.DecimalField(decimal_places=3, default=0, max_digits=10, verbose_name='Point')),
+                ('achieved', models.DateTimeField(blank=True, null=True, verbose_name='Achieved')),
+                ('game', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gameness.Game')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='playerbest',
+            index=models.Index(fields=['-score'], name='gameness_playerbest_score'),
+        ),
+        migrations.RunPython(backfill_player_best, migrations.RunPython.noop),
+    ]
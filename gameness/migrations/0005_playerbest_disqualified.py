@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_suspected_games(apps, schema_editor):
+    """
+    Count the suspected games of every player and disqualify the ones above the limit
+    """
+    PlayerBest = apps.get_model('gameness', 'PlayerBest')
+    SuspectedGame = apps.get_model('gameness', 'SuspectedGame')
+
+    counts = SuspectedGame.objects.values('player').annotate(suspected=Count('id')).order_by('player')
+    for row in counts.iterator():
+        PlayerBest.objects.update_or_create(
+            player=row['player'],
+            defaults={'suspected_games': row['suspected'],
+                      'disqualified': row['suspected'] > settings.SUSPECTED_GAMES_LIMIT})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameness', '0004_playerbest'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='playerbest',
+            name='gameness_playerbest_score',
+        ),
+        migrations.AddField(
+            model_name='playerbest',
+            name='disqualified',
+            field=models.BooleanField(default=False, verbose_name='Disqualified'),
+        ),
+        migrations.AddField(
+            model_name='playerbest',
+            name='suspected_games',
+            field=models.PositiveIntegerField(default=0, verbose_name='Suspected games'),
+        ),
+        migrations.AddIndex(
+            model_name='playerbest',
+            index=models.Index(fields=['disqualified', '-score'], name='gameness_playerbest_rank'),
+        ),
+        migrations.RunPython(backfill_suspected_games, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameness', '0005_playerbest_disqualified'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='turn',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name=''),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameness', '0006_turn_created_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['player', 'active', 'finished', 'created'], name='gameness_game_player_active'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['active', 'finished', '-score'], name='gameness_game_highscores'),
+        ),
+        migrations.AddIndex(
+            model_name='turn',
+            index=models.Index(fields=['game', 'created'], name='gameness_turn_game_created'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+import struct
+import sys
+from array import array
+
+from django.db import migrations, models
+
+CHUNK_SIZE = 500
+EMPTY = -1
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<BHH")
+
+
+def encode(playfield):
+    matrix = json.loads(playfield) or []
+    columns = len(matrix[0]) if matrix else 0
+    cells = array('h', (EMPTY if card is None else card for row in matrix for card in row))
+    if sys.byteorder == "big":
+        cells.byteswap()
+    return HEADER.pack(FORMAT_VERSION, len(matrix), columns) + cells.tobytes()
+
+
+def decode(data):
+    if not data:
+        return "{}"
+    version, rows, columns = HEADER.unpack_from(data)
+    cells = array('h')
+    cells.frombytes(bytes(data[HEADER.size:]))
+    if sys.byteorder == "big":
+        cells.byteswap()
+    cells = [None if card == EMPTY else card for card in cells]
+    return json.dumps([cells[i * columns:(i + 1) * columns] for i in range(rows)])
+
+
+def convert(apps, source, target, function):
+    """
+    Convert the playfield of every game in chunks of CHUNK_SIZE, walking the games in primary key order
+    """
+    Game = apps.get_model('gameness', 'Game')
+    last_pk = 0
+    while True:
+        games = list(Game.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', source)[:CHUNK_SIZE])
+        if not games:
+            break
+        for game in games:
+            setattr(game, target, function(getattr(game, source)))
+        Game.objects.bulk_update(games, [target])
+        last_pk = games[-1].pk
+
+
+def playfield_to_binary(apps, schema_editor):
+    convert(apps, 'playfield', 'board_data', encode)
+
+
+def binary_to_playfield(apps, schema_editor):
+    convert(apps, 'board_data', 'playfield', decode)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameness', '0007_manager_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='board_data',
+            field=models.BinaryField(default=bytes, verbose_name='Board'),
+        ),
+        migrations.RunPython(playfield_to_binary, binary_to_playfield),
+        migrations.RemoveField(
+            model_name='game',
+            name='playfield',
+        ),
+    ]
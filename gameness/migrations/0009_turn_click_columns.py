@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+
+from django.db import migrations, models
+
+CHUNK_SIZE = 1000
+FIELDS = ['first_row', 'first_column', 'first_card', 'second_row', 'second_column', 'second_card']
+
+
+def backfill_click_columns(apps, schema_editor):
+    """
+    Copy the clicks stored in Turn.meta to the click columns, in chunks of CHUNK_SIZE walking the turns in primary
+    key order. The time between the clicks was never stored and stays empty.
+    """
+    Turn = apps.get_model('gameness', 'Turn')
+    last_pk = 0
+    while True:
+        turns = list(Turn.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'meta')[:CHUNK_SIZE])
+        if not turns:
+            break
+        changed = []
+        for turn in turns:
+            try:
+                move = json.loads(turn.meta).get('click')
+            except (ValueError, AttributeError):
+                continue
+            if not move or len(move) != 2:
+                continue
+            first, second = move
+            turn.first_row, turn.first_column, turn.first_card = first.get('row'), first.get('column'), first.get('card')
+            turn.second_row, turn.second_column, turn.second_card = second.get('row'), second.get('column'), second.get('card')
+            changed.append(turn)
+        if changed:
+            Turn.objects.bulk_update(changed, FIELDS)
+        last_pk = turns[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameness', '0008_binary_playfield'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='turn',
+            name='click_interval',
+            field=models.FloatField(blank=True, null=True, verbose_name='Seconds between the clicks'),
+        ),
+        migrations.AddField(
+            model_name='turn',
+            name='first_card',
+            field=models.SmallIntegerField(blank=True, null=True, verbose_name='First click card'),
+        ),
+        migrations.AddField(
+            model_name='turn',
+            name='first_column',
+            field=models.SmallIntegerField(blank=True, null=True, verbose_name='First click column'),
+        ),
+        migrations.AddField(
+            model_name='turn',
+            name='first_row',
+            field=models.SmallIntegerField(blank=True, null=True, verbose_name='First click row'),
+        ),
+        migrations.AddField(
+            model_name='turn',
+            name='second_card',
+            field=models.SmallIntegerField(blank=True, null=True, verbose_name='Second click card'),
+        ),
+        migrations.AddField(
+            model_name='turn',
+            name='second_column',
+            field=models.SmallIntegerField(blank=True, null=True, verbose_name='Second click column'),
+        ),
+        migrations.AddField(
+            model_name='turn',
+            name='second_row',
+            field=models.SmallIntegerField(blank=True, null=True, verbose_name='Second click row'),
+        ),
+        migrations.RunPython(backfill_click_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameness', '0009_turn_click_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playerbest',
+            name='updated',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Updated'),
+        ),
+    ]
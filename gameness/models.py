@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 __author__ = 'klaswikblad'
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.utils import timezone
+
+from gameness import db, metrics
+from gameness import playfield as playfields
 
 import time
 import json
@@ -11,6 +17,8 @@ from decimal import Decimal
 
 log = logging.getLogger(__name__)
 
+board_cache = playfields.BoardCache(settings.PLAYFIELD_CACHE_SIZE) # Parsed boards of active games, see Game.get_board
+
 
 class GameManager(models.Manager):
 
@@ -32,35 +40,25 @@ class GameManager(models.Manager):
         """
         return self.filter(active=False, finished=True).order_by("-score")
 
+    @metrics.timed("player_best_score")
     def get_player_best_score(self, player):
         """
         Get the best score for a specific user
         :param player:
         :return:
         """
-        return self.get_highscores().filter(player=player).first()
+        best = PlayerBest.objects.filter(player=player, game__isnull=False).select_related("game").first()
+        return best.game if best else None
 
+    @metrics.timed("unique_highscores")
     def get_unique_highscores(self, num=5):
         """
-        Returns a list of scores from unique participants
+        Returns a list of scores from unique participants, read from the PlayerBest leaderboard
         :param contest:
         :param num:
         :return:
         """
-
-        scores = self.get_highscores()
-        # Purge all suspected games.
-        # scores = self.get_highscores().annotate(suspected_games=Count('suspects')).exclude(suspected_games__gt=0)
-        winnerlist = []
-        emails = []
-
-        # Distinct is not implemented in combination with annotate. so doing a poor mans version.
-        for score in scores:
-            if not score.player in emails:
-                winnerlist.append(score)
-                emails.append(score.player)
-            if len(winnerlist) == num:
-                break
+        winnerlist = [best.game for best in PlayerBest.objects.leaderboard()[:num]]
         enough_winners = bool(len(winnerlist) >= num)
         if not enough_winners:
             log.info(u"There are not enough unique contestants to fill the winnerlist")
@@ -93,8 +91,15 @@ class Game(models.Model):
     game_type = models.IntegerField("Game type", choices=((1, "Memory"),), default=MEMORY) # Which game type, as of now only Memory
     active = models.BooleanField("Active", default=False, null=False) # Indicates if the round is active or not
     finished = models.BooleanField("Finished", default=False, null=False) # Indicates if the player finished playing the round
-    playfield = models.TextField(default="{}") # Json serialized representation of the board
+    board_data = models.BinaryField("Board", default=bytes) # Binary representation of the board, see playfield.Board.to_bytes
     average_time = models.DecimalField("Average time for a round", default=0, max_digits=10, decimal_places=3)
+    engine = models.CharField("Playfield engine", max_length=16, choices=playfields.ENGINE_CHOICES,
+                              default=playfields.ENGINE_LEGACY) # Engine used to generate the playfield from the seed
+    # Turn counters, kept up to date by Turn.save so that scoring does not have to query the turns
+    turns_total = models.PositiveIntegerField("Turns", default=0)
+    turns_correct = models.PositiveIntegerField("Matching turns", default=0)
+    first_turn_at = models.DateTimeField("First turn", null=True, blank=True)
+    last_turn_at = models.DateTimeField("Last turn", null=True, blank=True)
 
     objects = GameManager()
 
@@ -109,6 +114,7 @@ class Game(models.Model):
         score = self.score.quantize(Decimal('0.001'))
         return score if score > 0 else 0
 
+    @metrics.timed("calculate_score")
     def calculate_score(self):
         """
         Method which calculates the score based on the amount of time, clicks and errors made.
@@ -116,9 +122,10 @@ class Game(models.Model):
         """
 
         correct_award = 150
-        turns_total = self.turns.count()
-        turns_correct = self.turns.filter(is_match=True).count()
-        seconds_left = (60.0 - (self.turns.last().created - self.turns.first().created).total_seconds()) or 0
+        seconds_per_pair = 20.0 # The 3 pairs of a 2x3 board get 60 seconds, larger boards get more time
+        turns_total = self.turns_total
+        turns_correct = self.turns_correct
+        seconds_left = (seconds_per_pair * turns_correct - self.play_time()) or 0
         maxpoints = turns_correct * correct_award
         deduction_for_errors = correct_award * 0.11123
 
@@ -127,9 +134,47 @@ class Game(models.Model):
 
         return Decimal(maxpoints)
 
+    def play_time(self):
+        """
+        Seconds between the first and the last turn
+        :return: float
+        """
+        if self.first_turn_at is None or self.last_turn_at is None:
+            return 0.0
+        return (self.last_turn_at - self.first_turn_at).total_seconds()
+
+    def calculate_average_time(self):
+        """
+        Average time in seconds for playing a turn
+        :return: Decimal
+        """
+        if not self.turns_total:
+            return Decimal(0)
+        return Decimal(self.play_time() / self.turns_total).quantize(Decimal('0.001'))
+
+    def pairs(self):
+        """
+        Number of pairs on the playfield
+        :return: int
+        """
+        return self.get_board().pairs
+
+    def count_turn(self, created, is_match):
+        """
+        Update the turn counters of this instance only, see Turn.update_game_counters
+        :param created: when the turn was played
+        :param is_match: whether the turn was a match
+        :return:
+        """
+        self.turns_total += 1
+        self.turns_correct += int(is_match)
+        self.first_turn_at = self.first_turn_at or created
+        self.last_turn_at = created
+
     def set_finished(self):
         self.finished = True
         self.active = False
+        board_cache.discard(self.board_cache_key())
 
     def match(self, move):
         """
@@ -161,17 +206,50 @@ class Game(models.Model):
             log.warning(f"Illegal call to get_card_id with values: {click}")
             return False
         else:
-            # Load the playfield matrix
-            playfield = json.loads(self.playfield)
-            return playfield[click['row']][click['column']]
+            return self.get_board().card(click['row'], click['column'])
+
+    def board_cache_key(self):
+        return self.pk, self.seed
+
+    def get_board(self):
+        """
+        Get the decoded playfield. Boards of active games are kept in the process local board cache so that a click
+        does not have to decode the whole playfield again.
+        :return: playfield.Board
+        """
+        if self.pk is None or self.finished:
+            return playfields.Board.from_bytes(self.board_data)
+
+        key = self.board_cache_key()
+        board = board_cache.get(key)
+        if board is None:
+            board = playfields.Board.from_bytes(self.board_data)
+            board_cache.set(key, board)
+        return board
+
+    def set_board(self, board):
+        self.board_data = board.to_bytes()
+
+    @property
+    def playfield(self):
+        """
+        Json serialized representation of the board, as a list of rows
+        """
+        return json.dumps(playfields.Board.from_bytes(self.board_data).to_matrix())
+
+    @playfield.setter
+    def playfield(self, value):
+        self.set_board(playfields.Board.from_json(value))
 
     @staticmethod
-    def generate_play_field(row, column, seed):
+    def generate_play_field(row, column, seed, engine=None):
         """
         Generates the playfield matrix and store it in the game object as a string
         :param row: y rows
         :param column: x columns
         :param seed: seed to feed into the engine
+        :param engine: playfield engine, defaults to settings.PLAYFIELD_ENGINE. Use playfields.ENGINE_LEGACY to
+                       reproduce the boards of games created before the shuffle engine.
         :return:
         """
         if hasattr(row, 'startswith'):
@@ -180,36 +258,8 @@ class Game(models.Model):
         if hasattr(column, 'startswith'):
             column = int(column)
 
-        import random
         start_time = time.time()
-        log.info("Start to generate playfield")
-        matrix = []
-        for i in range(row):
-            matrix.append([None])
-            tmplist = [None for tmp in range(column)]
-            matrix[i] = tmplist
-        squares = row * column
-
-        pairs = squares // 2
-        seed_list = [str(ord(i)) for i in seed]
-        seed_int = int(''.join(seed_list))
-        random.seed(a=seed_int)
-
-        row1 = row2 = column1 = column2 = None
-        for pair in range(pairs):
-            still_looking = True
-            while still_looking:
-                row1 = divmod(random.randint(0, 1000), row)[1]
-                column1 = divmod(random.randint(0, 1000), column)[1]
-
-                row2 = divmod(random.randint(0, 1000), row)[1]
-                column2 = divmod(random.randint(0, 1000), column)[1]
-                if not (row1 == row2 and column1 == column2) and matrix[row1][column1] is None and matrix[row2][
-                    column2] is None:
-                    still_looking = False
-            matrix[row1][column1] = pair
-            matrix[row2][column2] = pair
-            log.info("Pair {} found!".format(pair))
+        matrix = playfields.generate(row, column, seed, engine or settings.PLAYFIELD_ENGINE)
         stop_time = time.time() - start_time # Check the amount of time it takes
         log.info("Time for creating the playfield: {} s".format(stop_time))
         return json.dumps(matrix), stop_time
@@ -219,19 +269,108 @@ class Game(models.Model):
 
     class Meta:
         app_label="gameness"
+        indexes = [
+            # active_game, player_has_active_games and stop_active_games_for_player
+            models.Index(fields=["player", "active", "finished", "created"], name="gameness_game_player_active"),
+            # get_highscores
+            models.Index(fields=["active", "finished", "-score"], name="gameness_game_highscores"),
+        ]
+
+
+class TurnManager(models.Manager):
+
+    def miss_rate_per_card(self):
+        """
+        For every card, how many turns started by turning it and how many of them missed, computed in one GROUP BY
+        :return: values queryset of {'card', 'turns', 'misses'}
+        """
+        return self.filter(first_card__isnull=False).values(card=F('first_card')).annotate(
+            turns=Count('id'), misses=Count('id', filter=Q(is_match=False))).order_by('card')
+
+    def misses_per_square(self):
+        """
+        Number of missed turns per square of the second click, an error heatmap of the board
+        :return: values queryset of {'row', 'column', 'misses'}
+        """
+        return self.filter(is_match=False, second_row__isnull=False).values(
+            row=F('second_row'), column=F('second_column')).annotate(misses=Count('id')).order_by('row', 'column')
 
 
 class Turn(models.Model):
     """
     This model represents every two clicks = one round the user has performed.
     """
-    created = models.DateTimeField('', auto_now_add=True)
+    created = models.DateTimeField('', default=timezone.now) # Not auto_now_add, write-behind turns keep the time they were played
     meta = models.TextField(default="{}") # Used to store json data containing information about each turn, for details check the tests
     game = models.ForeignKey(Game, related_name='turns', on_delete=models.CASCADE)
     is_match = models.BooleanField("Match", default=False) # Whether the turn resulted in a match
+    # The clicks of meta as columns, so that they can be aggregated in SQL
+    first_row = models.SmallIntegerField("First click row", null=True, blank=True)
+    first_column = models.SmallIntegerField("First click column", null=True, blank=True)
+    first_card = models.SmallIntegerField("First click card", null=True, blank=True)
+    second_row = models.SmallIntegerField("Second click row", null=True, blank=True)
+    second_column = models.SmallIntegerField("Second click column", null=True, blank=True)
+    second_card = models.SmallIntegerField("Second click card", null=True, blank=True)
+    click_interval = models.FloatField("Seconds between the clicks", null=True, blank=True)
+
+    objects = TurnManager()
+
+    @classmethod
+    def from_move(cls, game, move, is_match, click_interval=None, **kwargs):
+        """
+        Build an unsaved turn from the two clicks returned by Game.match
+        :param game: Game
+        :param move: [{'row', 'column', 'card'}, {'row', 'column', 'card'}]
+        :param is_match: whether the turn was a match
+        :param click_interval: seconds between the clicks
+        :return: Turn
+        """
+        turn = cls(game=game, meta=json.dumps({'click': move}), is_match=is_match, click_interval=click_interval,
+                   **kwargs)
+        turn.set_clicks(move)
+        return turn
+
+    def set_clicks(self, move):
+        """
+        Fill the click columns from a move
+        :param move: [{'row', 'column', 'card'}, {'row', 'column', 'card'}]
+        :return:
+        """
+        first, second = move
+        self.first_row, self.first_column, self.first_card = first['row'], first['column'], first.get('card')
+        self.second_row, self.second_column, self.second_card = second['row'], second['column'], second.get('card')
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if self.first_row is None:
+            move = json.loads(self.meta).get('click')
+            if move and len(move) == 2:
+                self.set_clicks(move)
+        super(Turn, self).save(*args, **kwargs)
+        if adding:
+            self.update_game_counters()
+
+    def update_game_counters(self):
+        """
+        Count this turn on the game with a single atomic update, and mirror the change on the game instance if it is
+        loaded, so that the caller can score the game without reading it again.
+        Turns created with bulk_create do not pass through save and have to be counted by the caller.
+        :return:
+        """
+        Game.objects.filter(pk=self.game_id).update(
+            turns_total=F('turns_total') + 1,
+            turns_correct=F('turns_correct') + int(self.is_match),
+            first_turn_at=Coalesce(F('first_turn_at'), Value(self.created, output_field=models.DateTimeField())),
+            last_turn_at=self.created,
+        )
+        if Turn.game.is_cached(self):
+            self.game.count_turn(self.created, self.is_match)
 
     class Meta:
         app_label="gameness"
+        indexes = [
+            models.Index(fields=["game", "created"], name="gameness_turn_game_created"),
+        ]
 
 
 class SuspectedGame(models.Model):
@@ -246,12 +385,87 @@ class SuspectedGame(models.Model):
     created = models.DateTimeField(auto_now_add=True)
 
     @staticmethod
+    @db.retry_on_lock
     def is_game_suspected(game):
         if game.average_time < settings.SUSPECTED_THRESHOLD:
             msg = f"The round {game.id} by {game.player} may be cheating. Average time for a round is {game.average_time}."
-            SuspectedGame.objects.create(game=game, player=game.player, reason=msg)
+            with transaction.atomic():
+                SuspectedGame.objects.create(game=game, player=game.player, reason=msg)
+                PlayerBest.objects.record_suspected_game(game.player)
             return True
         return False
 
     class Meta:
-        app_label="gameness"
\ No newline at end of file
+        app_label="gameness"
+
+
+class PlayerBestManager(models.Manager):
+
+    def leaderboard(self):
+        """
+        The best game of every player who has not been disqualified, highest score first
+        :return:
+        """
+        return self.filter(disqualified=False, game__isnull=False).select_related("game").order_by("-score")
+
+    @metrics.timed("record_game")
+    def record_game(self, game):
+        """
+        Upsert the players best score with a finished game
+        :param game: finished Game
+        :return: True if the game is the new best score of the player
+        """
+        now = timezone.now()
+        values = {"score": game.score, "game": game, "achieved": now, "updated": now}
+        # A row without a game is a placeholder for the suspected games counter, any game replaces it
+        improves = Q(score__lt=game.score) | Q(game__isnull=True)
+        if self.filter(improves, player=game.player).update(**values):
+            return True
+        if self.filter(player=game.player).exists():
+            return False
+        try:
+            with transaction.atomic():
+                self.create(player=game.player, **values)
+            return True
+        except IntegrityError:
+            # Another request created the row in the meantime
+            return bool(self.filter(improves, player=game.player).update(**values))
+
+    def record_suspected_game(self, player):
+        """
+        Count a suspected game for the player and disqualify the player once there are more than
+        settings.SUSPECTED_GAMES_LIMIT of them
+        :param player:
+        :return: True if the player is disqualified
+        """
+        now = timezone.now()
+        if not self.filter(player=player).update(suspected_games=F('suspected_games') + 1, updated=now):
+            try:
+                with transaction.atomic():
+                    self.create(player=player, suspected_games=1, updated=now)
+            except IntegrityError:
+                self.filter(player=player).update(suspected_games=F('suspected_games') + 1, updated=now)
+        self.filter(player=player, suspected_games__gt=settings.SUSPECTED_GAMES_LIMIT, disqualified=False).update(
+            disqualified=True, updated=now)
+        return self.filter(player=player, disqualified=True).exists()
+
+
+class PlayerBest(models.Model):
+    """
+    Leaderboard with the best game of every player, maintained when games are finished.
+    """
+    player = models.EmailField(unique=True) # Email address identifying the player
+    score = models.DecimalField("Point", default=0, max_digits=10, decimal_places=3) # Best score of the player
+    game = models.ForeignKey(Game, blank=True, null=True, related_name='+', on_delete=models.SET_NULL) # Game with the best score
+    achieved = models.DateTimeField("Achieved", null=True, blank=True) # When the best score was set
+    suspected_games = models.PositiveIntegerField("Suspected games", default=0) # Number of SuspectedGame records of the player
+    disqualified = models.BooleanField("Disqualified", default=False) # Too many suspected games, hidden from the leaderboard
+    updated = models.DateTimeField("Updated", null=True, blank=True, db_index=True) # Last change, read by the rank index sync
+
+    objects = PlayerBestManager()
+
+    class Meta:
+        app_label="gameness"
+        indexes = [
+            models.Index(fields=["disqualified", "-score"], name="gameness_playerbest_rank"),
+        ]
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of pre-generated playfields, so that ContestView does not have to generate the board while the player waits.
+
+The pool is process local. gameness/wsgi.py warms it when the worker boots, a background thread fills the dimensions
+of settings.PLAYFIELD_POOL_DIMENSIONS up to settings.PLAYFIELD_POOL_SIZE boards. Popping a board wakes the thread up
+again, other dimensions are added when they are first asked for. When the pool is empty ContestView generates the
+board inline. A process forked from a warmed one, such as a gunicorn worker of a preloading master, drops the boards
+it inherited and warms its own pool.
+"""
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+
+from django.conf import settings
+
+from gameness import playfield as playfields
+
+log = logging.getLogger(__name__)
+
+
+class PlayfieldPool(object):
+    """
+    Bounded pool of (seed, engine, board_data) per board dimension, board_data is the encoded playfield.Board.
+    """
+
+    def __init__(self, size, dimensions=()):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._boards = dict(((rows, columns), deque()) for rows, columns in dimensions)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def pop(self, rows, columns):
+        """
+        Take a ready board from the pool
+        :param rows: y rows
+        :param columns: x columns
+        :return: (seed, engine, board_data) or None if the pool is empty
+        """
+        if self.size <= 0:
+            return None
+
+        with self._lock:
+            boards = self._boards.setdefault((rows, columns), deque())
+            if boards:
+                self.hits += 1
+                board = boards.popleft()
+            else:
+                self.misses += 1
+                board = None
+        self.start()
+        self._wakeup.set()
+        return board
+
+    def refill(self):
+        """
+        Generate boards until every dimension in the pool is full
+        :return: number of generated boards
+        """
+        generated = 0
+        with self._lock:
+            missing = [(dimensions, self.size - len(boards)) for dimensions, boards in self._boards.items()]
+        for (rows, columns), count in missing:
+            for i in range(count):
+                seed = uuid.uuid4().hex
+                engine = settings.PLAYFIELD_ENGINE
+                board = (seed, engine, playfields.generate_board(rows, columns, seed, engine).to_bytes())
+                with self._lock:
+                    self._boards[(rows, columns)].append(board)
+                generated += 1
+        return generated
+
+    def start(self):
+        """
+        Start the background refill thread unless it is already running
+        """
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="playfield-pool", daemon=True)
+                self._thread.start()
+
+    def warm(self):
+        """
+        Start the background refill thread and fill every known dimension, without waiting for the first pop
+        """
+        if self.size <= 0:
+            return
+        self.start()
+        self._wakeup.set()
+
+    def _after_fork(self):
+        # The thread of the parent does not run in the child, and the boards would be handed out by both processes
+        warm = self._thread is not None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        for boards in self._boards.values():
+            boards.clear()
+        if warm:
+            self.warm()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self.refill()
+            except Exception:
+                log.exception("Could not refill the playfield pool")
+
+    def stats(self):
+        """
+        Hit and miss counters together with the number of ready boards per dimension
+        :return: dict
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "ready": dict((f"{rows}x{columns}", len(boards)) for (rows, columns), boards in self._boards.items()),
+            }
+
+
+playfield_pool = PlayfieldPool(settings.PLAYFIELD_POOL_SIZE,
+                               [playfields.parse_dimensions(size) for size in settings.PLAYFIELD_POOL_DIMENSIONS])
+os.register_at_fork(after_in_child=playfield_pool._after_fork)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Rank of a player on the PlayerBest leaderboard, "you are #4,213 of 90,000".
+
+Every process keeps the best score of every ranked player in a sorted list, the rank of a player is a bisect of the
+list and the players around a rank are a slice of it, so neither counts rows in the database. The index is loaded from
+PlayerBest the first time it is needed and updated right away when a game finished in this process changes the
+leaderboard. Changes made by the other workers are picked up with the PlayerBest.updated column, at most every
+settings.RANK_INDEX_REFRESH seconds. Players tied on a score share a rank, the next score gets the rank after all of
+them ("1224" ranking).
+"""
+import bisect
+import datetime
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from gameness import metrics
+from gameness.models import PlayerBest
+
+SYNC_OVERLAP = 10 # Seconds the sync looks back before the last one, for transactions which committed late
+
+
+class RankIndex(object):
+    """
+    Sorted (-score, player) keys of the ranked players
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.scores = {} # player -> score of the players in keys
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.synced_at = 0.0 # time.time() of the last load or sync
+
+    def __len__(self):
+        return len(self.keys)
+
+    def load(self, rows):
+        """
+        Replace the index
+        :param rows: iterable of (player, score)
+        """
+        with self.lock:
+            self.scores = dict(rows)
+            self.keys = sorted((-score, player) for player, score in self.scores.items())
+
+    def update(self, player, score=None):
+        """
+        Set the score of a player, or drop the player from the index
+        :param player:
+        :param score: best score, None if the player is not ranked
+        """
+        with self.lock:
+            old = self.scores.pop(player, None)
+            if old is not None:
+                del self.keys[bisect.bisect_left(self.keys, (-old, player))]
+            if score is not None:
+                self.scores[player] = score
+                bisect.insort(self.keys, (-score, player))
+
+    def rank(self, player):
+        """
+        :return: (rank, score) of the player, None if the player is not ranked
+        """
+        with self.lock:
+            score = self.scores.get(player)
+            if score is None:
+                return None
+            return bisect.bisect_left(self.keys, (-score,)) + 1, score
+
+    def position(self, player):
+        """
+        :return: place of the player in the list, tied players are ordered by their email, None if not ranked
+        """
+        with self.lock:
+            score = self.scores.get(player)
+            if score is None:
+                return None
+            return bisect.bisect_left(self.keys, (-score, player)) + 1
+
+    def around(self, position, radius=5):
+        """
+        The players from radius places before to radius places after a place in the list. Without ties the place
+        is the rank.
+        :param position: 1 is the best player
+        :param radius:
+        :return: list of {'rank', 'player', 'score'}
+        """
+        with self.lock:
+            start = max(0, position - 1 - radius)
+            keys = self.keys[start:max(0, position + radius)]
+            if not keys:
+                return []
+            current = bisect.bisect_left(self.keys, (keys[0][0],)) + 1
+            rows = []
+            for place, (score, player) in enumerate(keys, start + 1):
+                if rows and score != -rows[-1]["score"]:
+                    current = place
+                rows.append({"rank": current, "player": player, "score": -score})
+            return rows
+
+
+rank_index = RankIndex()
+
+
+def ranked_players():
+    """
+    PlayerBest rows which are on the leaderboard
+    """
+    return PlayerBest.objects.filter(disqualified=False, game__isnull=False)
+
+
+def get_index():
+    """
+    The rank index of the process, loaded or synced with the leaderboard when needed
+    :return: RankIndex
+    """
+    now = time.time()
+    if not rank_index.loaded:
+        with metrics.timer("rank_index.load"):
+            rank_index.load(ranked_players().values_list("player", "score").iterator())
+        rank_index.loaded = True
+        rank_index.synced_at = now
+    elif now - rank_index.synced_at >= settings.RANK_INDEX_REFRESH:
+        since = datetime.datetime.fromtimestamp(rank_index.synced_at - SYNC_OVERLAP, tz=timezone.utc)
+        rank_index.synced_at = now
+        for player, score, disqualified, game_id in PlayerBest.objects.filter(updated__gte=since).values_list(
+                "player", "score", "disqualified", "game_id"):
+            rank_index.update(player, None if disqualified or game_id is None else score)
+    return rank_index
+
+
+def game_finished(game, new_best, suspected):
+    """
+    Update the index of this process when a finished game changed the leaderboard
+    :param game: finished Game
+    :param new_best: the game is the new personal best of the player, see PlayerBestManager.record_game
+    :param suspected: a SuspectedGame was recorded for the game, the player may be disqualified
+    """
+    if not rank_index.loaded or not (new_best or suspected):
+        return
+    best = ranked_players().filter(player=game.player).values_list("score", flat=True).first()
+    rank_index.update(game.player, best)
+
+
+def player_rank(player, radius=0):
+    """
+    :param player:
+    :param radius: players before and after the player to include
+    :return: {'rank', 'score', 'players', 'around'}, rank and score are None if the player is not ranked
+    """
+    index = get_index()
+    found = index.rank(player)
+    rank, score = found or (None, None)
+    return {
+        "rank": rank,
+        "score": score,
+        "players": len(index),
+        "around": index.around(index.position(player), radius) if found and radius else [],
+    }
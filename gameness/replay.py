@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Replay verification of finished games, used by the verify_games command.
+
+A board is determined by the seed and the engine of the game, so a finished game can be played again from its turns:
+the board is generated again, every turn is matched against it and the score is calculated from the replayed turns.
+verify_chunk only works on plain values and does not touch the database, so chunks can be verified in worker
+processes.
+"""
+from decimal import Decimal
+
+from gameness import playfield as playfields
+
+# Values read for every game and every turn, in this order
+GAME_FIELDS = ("id", "player", "seed", "engine", "board_data", "score", "turns_total", "turns_correct")
+TURN_FIELDS = ("game_id", "created", "is_match", "first_row", "first_column", "first_card", "second_row",
+               "second_column", "second_card")
+
+
+def setup_worker():
+    """
+    Process pool initializer, set up Django in workers which were not forked from a process that already did
+    """
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def replay_score(turns):
+    """
+    Score of a game played with the given turns, calculated the same way as when the game finished
+    :param turns: list of (created, is_match)
+    :return: Decimal rounded like Game.score
+    """
+    from gameness.models import Game
+
+    game = Game(turns_total=len(turns), turns_correct=sum(1 for created, is_match in turns if is_match),
+                first_turn_at=turns[0][0] if turns else None, last_turn_at=turns[-1][0] if turns else None)
+    return game.calculate_score().quantize(Decimal("0.001"))
+
+
+def verify_game(game, turns, tolerance=Decimal("0.01")):
+    """
+    Replay one finished game
+    :param game: dict with GAME_FIELDS
+    :param turns: dicts with TURN_FIELDS of the game, in the order they were played
+    :param tolerance: largest accepted difference between the stored and the replayed score
+    :return: list of the reasons why the game does not verify, empty if it does
+    """
+    reasons = []
+    stored = playfields.Board.from_bytes(game["board_data"])
+    try:
+        board = playfields.generate_board(stored.rows, stored.columns, game["seed"], game["engine"])
+    except ValueError as e:
+        return [f"the board can not be generated: {e}"]
+    if board.cells != stored.cells:
+        reasons.append("the board does not match the seed")
+
+    matched = set()
+    replayed = []
+    for number, turn in enumerate(turns, 1):
+        try:
+            first = board.card(turn["first_row"], turn["first_column"])
+            second = board.card(turn["second_row"], turn["second_column"])
+        except (IndexError, TypeError):
+            reasons.append(f"turn {number} clicked outside of the board")
+            continue
+        if (turn["first_card"], turn["second_card"]) != (first, second):
+            reasons.append(f"turn {number} shows other cards than the board")
+        is_match = first is not None and first == second and \
+            (turn["first_row"], turn["first_column"]) != (turn["second_row"], turn["second_column"])
+        if is_match != turn["is_match"]:
+            reasons.append(f"turn {number} is recorded as {'a match' if turn['is_match'] else 'a miss'}")
+        if is_match and first in matched:
+            reasons.append(f"turn {number} matched an already matched pair")
+        if is_match:
+            matched.add(first)
+        replayed.append((turn["created"], is_match))
+
+    turns_correct = sum(1 for created, is_match in replayed if is_match)
+    if (game["turns_total"], game["turns_correct"]) != (len(turns), turns_correct):
+        reasons.append(f"the turn counters {game['turns_total']}/{game['turns_correct']} do not match the "
+                       f"{len(turns)}/{turns_correct} replayed turns")
+    if len(matched) < board.pairs:
+        reasons.append(f"only {len(matched)} of {board.pairs} pairs were found")
+
+    score = replay_score(replayed)
+    if abs(Decimal(game["score"]) - score) > tolerance:
+        reasons.append(f"the score {game['score']} does not match the replayed score {score}")
+    return reasons
+
+
+def verify_chunk(chunk, tolerance=Decimal("0.01")):
+    """
+    Replay a chunk of games
+    :param chunk: list of (game, turns), see verify_game
+    :param tolerance: see verify_game
+    :return: list of (game id, player, reasons) of the games which do not verify
+    """
+    failed = []
+    for game, turns in chunk:
+        reasons = verify_game(game, turns, tolerance)
+        if reasons:
+            failed.append((game["id"], game["player"], reasons))
+    return failed
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Retention of old games, used by the prune_games command.
+
+Abandoned games, unfinished games older than settings.GAME_ABANDONED_AFTER, are deleted with their turns. Finished
+games older than settings.GAME_RETENTION_DAYS are first written to a gzip compressed JSON lines archive and then
+deleted. Games kept as evidence by a SuspectedGame (the relation is PROTECT) and games holding a PlayerBest score are
+never touched.
+
+The games are handled in small batches, every batch is deleted in its own short transaction and the caller pauses
+between the batches, so the SQLite write lock is only held briefly and the game keeps running alongside.
+"""
+import base64
+import datetime
+import gzip
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import ProtectedError
+from django.utils import timezone
+
+from gameness import export
+from gameness.models import Game, PlayerBest, Turn
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 200 # Games per transaction, well below the 999 variables SQLite accepts in one query
+
+
+def abandoned_games(now=None):
+    """
+    Unfinished games which will never be finished
+    """
+    before = (now or timezone.now()) - datetime.timedelta(seconds=settings.GAME_ABANDONED_AFTER)
+    return Game.objects.filter(finished=False, created__lt=before, suspects__isnull=True)
+
+
+def expired_games(now=None):
+    """
+    Finished games older than the retention period
+    """
+    before = (now or timezone.now()) - datetime.timedelta(days=settings.GAME_RETENTION_DAYS)
+    return Game.objects.filter(finished=True, created__lt=before, suspects__isnull=True).exclude(
+        pk__in=PlayerBest.objects.filter(game__isnull=False).values("game_id"))
+
+
+def batches(games, batch_size=BATCH_SIZE):
+    """
+    Walk the ids of the games in batches, every batch is a new query for the ids after the last one
+    :return: iterator of lists of ids
+    """
+    last_pk = 0
+    while True:
+        ids = list(games.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return
+        yield ids
+        last_pk = ids[-1]
+
+
+def delete_games(ids):
+    """
+    Delete the games and their turns in one transaction. Games for which a SuspectedGame was created in the meantime
+    are kept and the others are deleted in a new transaction.
+    :return: number of deleted games
+    """
+    while ids:
+        try:
+            with transaction.atomic():
+                Turn.objects.filter(game_id__in=ids).delete()
+                return Game.objects.filter(pk__in=ids).delete()[1].get(Game._meta.label, 0)
+        except ProtectedError:
+            kept = set(ids) - set(Game.objects.filter(pk__in=ids, suspects__isnull=True).values_list("pk", flat=True))
+            if not kept:
+                raise
+            log.warning(f"Games {sorted(kept)} became suspected while they were pruned, keeping them.")
+            ids = [pk for pk in ids if pk not in kept]
+    return 0
+
+
+def archive_games(ids, output):
+    """
+    Write the games with their turns as JSON lines, one game per line with its board base64 encoded and its turns
+    in the order they were played
+    :param ids: game ids
+    :param output: text file
+    :return: number of archived games
+    """
+    game_fields = export.DATASETS["games"][1]
+    turn_fields = export.DATASETS["turns"][1]
+    turns = dict((pk, []) for pk in ids)
+    for turn in Turn.objects.filter(game_id__in=ids).order_by("game_id", "created", "pk").values(*turn_fields):
+        turns[turn["game_id"]].append(turn)
+
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    count = 0
+    for game in Game.objects.filter(pk__in=ids).order_by("pk").values(*game_fields + ("board_data",)):
+        game["board_data"] = base64.b64encode(bytes(game["board_data"])).decode()
+        game["turns"] = turns[game["id"]]
+        output.write(encoder.encode(game) + "\n")
+        count += 1
+    return count
+
+
+def archive_path(directory, now=None):
+    return os.path.join(directory, f"games-{(now or timezone.now()):%Y%m%d-%H%M%S}.jsonl.gz")
+
+
+def prune_abandoned(batch_size=BATCH_SIZE, pause=0.0, now=None):
+    """
+    Delete the abandoned games
+    :param pause: seconds to sleep between the batches
+    :return: number of deleted games
+    """
+    deleted = 0
+    for ids in batches(abandoned_games(now), batch_size):
+        deleted += delete_games(ids)
+        time.sleep(pause)
+    return deleted
+
+
+def archive_expired(path, batch_size=BATCH_SIZE, pause=0.0, now=None):
+    """
+    Archive the expired games to a gzip file and delete them. Every batch is written and flushed to the file before
+    it is deleted, if the run is interrupted the last batch may be archived again by the next run. A game which
+    became suspected in between stays in the database as evidence, and in the archive.
+    :param path: archive file, created only if there is something to archive
+    :param pause: seconds to sleep between the batches
+    :return: number of archived and deleted games
+    """
+    archived = 0
+    output = None
+    try:
+        for ids in batches(expired_games(now), batch_size):
+            if output is None:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                output = gzip.open(path, "wt", encoding="utf-8")
+            archive_games(ids, output)
+            output.flush()
+            archived += delete_games(ids)
+            time.sleep(pause)
+    finally:
+        if output is not None:
+            output.close()
+    return archived
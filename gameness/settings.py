@@ -29,6 +29,51 @@ ALLOWED_HOSTS = ['memory.apparelrow.com']
 
 STATICFILES_DIRS = ("gameness/static",)
 SUSPECTED_THRESHOLD = 1.5
+SUSPECTED_GAMES_LIMIT = 1 # Players with more suspected games than this are disqualified from the highscores
+
+# Engine used for new playfields, "shuffle" or "legacy" (see gameness/playfield.py)
+PLAYFIELD_ENGINE = "shuffle"
+# Number of parsed boards of active games kept in memory per process, 0 disables the cache
+PLAYFIELD_CACHE_SIZE = 1024
+# Board dimensions a game can be played on, the contest page picks one of them with ?board=<rows>x<columns>
+GAME_BOARD_SIZES = ("2x3", "4x4", "6x6", "8x8", "10x10", "16x16", "32x32", "64x64")
+GAME_BOARD_SIZE = "2x3" # Board of the games which do not pick one
+
+# Pre-generated playfields kept ready per board dimension and process, 0 disables the pool (see gameness/pool.py)
+PLAYFIELD_POOL_SIZE = 20
+PLAYFIELD_POOL_DIMENSIONS = GAME_BOARD_SIZES # Dimensions filled when the worker boots, others when first asked for
+
+# Where the state of the game being played is kept between clicks, "session" writes every turn to the database right
+# away, "hybrid" does the same but keeps the pending click in the GAME_STATE_CACHE backend instead of the session,
+# "cache" keeps the turns in the GAME_STATE_CACHE backend until the game is over (see gameness/gamestate.py)
+GAME_STATE_ENGINE = "session"
+GAME_STATE_CACHE = "default"
+GAME_STATE_TIMEOUT = 60 * 60 * 2 # Seconds before a cached game state expires
+GAME_STATE_IDLE = 60 * 5 # Seconds without clicks before flush_game_states writes a game state to the database
+GAME_BATCH_MAX_CLICKS = 100 # Most clicks accepted by one request to the batch endpoint
+GAME_ASSETS_MAX_AGE = 60 * 60 # Seconds browsers keep the static game data before revalidating it
+
+# Cached top list of the highscore page, invalidated when a finished game can change it (see gameness/highscores.py).
+# The backend has to be shared by all workers and the management commands, otherwise they never see the invalidation
+HIGHSCORE_CACHE = "shared"
+HIGHSCORE_CACHE_TIMEOUT = 60 * 60 # Seconds a top list is cached, also how long tables of old versions linger
+HIGHSCORE_SIZE = 5 # Players on the top list
+RANK_INDEX_REFRESH = 5 # Seconds between two syncs of the rank index with the other workers (see gameness/ranks.py)
+LEADERBOARD_PAGE_SIZE = 25 # Rows per page of the leaderboard endpoint
+LEADERBOARD_PAGE_MAX = 100 # Most rows a client can ask for per page
+
+# Retention, see the prune_games command and gameness/retention.py
+GAME_ABANDONED_AFTER = 60 * 60 * 24 # Seconds before an unfinished game is deleted as abandoned
+GAME_RETENTION_DAYS = 365 # Finished games older than this are archived and deleted
+GAME_ARCHIVE_DIR = os.path.join(BASE_DIR, "archive")
+
+# SQLite concurrency, see gameness/db.py. WAL lets the clicks read while another worker writes
+SQLITE_WAL = True
+DB_LOCK_RETRIES = 3 # Times a write path is run again after failing on a locked database
+DB_LOCK_BACKOFF = 0.05 # Seconds before the first retry, doubled for every further one
+
+# /metrics/ is for staff members, and for the addresses listed here which scrape it without logging in (Prometheus)
+METRICS_ALLOWED_IPS = ()
 
 # Application definition
 
@@ -43,6 +88,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE = (
+    'gameness.metrics.MetricsMiddleware', # First, so that the time of the other middleware is measured too
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -72,6 +118,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'gameness.wsgi.application'
 
+TEST_RUNNER = 'gameness.testrunner.TestRunner' # Keeps the tests out of the shared cache directory
+
 
 # Database
 # https://docs.djangoproject.com/en/1.8/ref/settings/#databases
@@ -80,9 +128,22 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {'timeout': 10}, # Seconds a writer waits for the database lock before failing
+        'CONN_MAX_AGE': 60, # Seconds a connection is kept open between requests
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Seen by every process on the host
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    },
+}
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
@@ -98,3 +159,31 @@ STATIC_URL = '/static/'
 STATIC_ROOT = 'static'
 
 USER_EMAILS = [f"{x}@email.com" for x in range(1,10)]
+
+# Logging, the handlers of LOGGING_ASYNC_LOGGERS write from a background thread (see gameness/logqueue.py)
+LOGGING_CONFIG = 'gameness.logqueue.configure'
+LOGGING_ASYNC_LOGGERS = ('gameness',)
+LOGGING_QUEUE_SIZE = 10000 # Records waiting to be written, more are dropped instead of blocking the request
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'verbose': {'format': '%(asctime)s %(levelname)s %(process)d %(name)s %(message)s'},
+    },
+    'filters': {
+        # Only every tenth info message of the game models, warnings and errors always pass
+        'sample': {'()': 'gameness.logqueue.SampleFilter', 'rate': 0.1, 'max_level': 'INFO'},
+        # At most 10 messages a minute from every line that logs
+        'rate_limit': {'()': 'gameness.logqueue.RateLimitFilter', 'rate': 10, 'per': 60},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'verbose'},
+    },
+    'loggers': {
+        'gameness': {'handlers': ['console'], 'level': os.environ.get("GAMENESS_LOG_LEVEL", "INFO"),
+                     'propagate': False},
+        'gameness.models': {'filters': ['sample', 'rate_limit']},
+        'gameness.views': {'filters': ['rate_limit']},
+    },
+}
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Test runner of the project, settings.TEST_RUNNER.
+"""
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with a "shared" cache directory of their own, the one of the settings is used by the running site.
+    The cache is replaced before the test database is set up, which already opens every cache backend.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super(TestRunner, self).setup_test_environment(**kwargs)
+        self.cache_location = tempfile.mkdtemp(prefix="gameness-cache-")
+        shared = dict(settings.CACHES["shared"], LOCATION=self.cache_location)
+        self.test_caches = override_settings(CACHES=dict(settings.CACHES, shared=shared))
+        self.test_caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_caches.disable()
+        shutil.rmtree(self.cache_location, ignore_errors=True)
+        super(TestRunner, self).teardown_test_environment(**kwargs)
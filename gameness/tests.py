@@ -1,15 +1,38 @@
 # -*- coding: utf-8 -*-
 __author__ = 'klaswikblad'
 
-from django.test import TestCase
+from unittest import mock, skipUnless
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 
-from gameness.models import Game, Turn, SuspectedGame
+from gameness import assets, db, export, gamestate, highscores, leaderboard, logqueue, metrics, ranks, retention
+from gameness import playfield as playfields
+from gameness.models import Game, PlayerBest, PlayerBestManager, Turn, SuspectedGame, board_cache
+from gameness.pool import PlayfieldPool
 
+import base64
+import csv
+import gzip
+import os
+import tempfile
+import time
 import uuid
 import json
+import logging
+from queue import Queue
+from logging.handlers import BufferingHandler, QueueListener
 import datetime
+from decimal import Decimal
+from io import StringIO
 from model_mommy.mommy import make
 
 class TestCreateGameAndTurns(TestCase):
@@ -117,7 +140,7 @@ class TestCreateGameAndTurns(TestCase):
         seed = 'd155dcffad1e448f8644d0381be70736'
         row = 4
         column = 3
-        matrix, seconds = Game.generate_play_field(row, column, seed)
+        matrix, seconds = Game.generate_play_field(row, column, seed, playfields.ENGINE_LEGACY)
         matrix = json.loads(matrix)
 
         for rows in matrix:
@@ -134,6 +157,119 @@ class TestCreateGameAndTurns(TestCase):
         [5, 2, 0]
         """
 
+    def test_generate_play_field_shuffle(self):
+        seed = 'd155dcffad1e448f8644d0381be70736'
+        for row, column in ((2, 3), (4, 3), (5, 5), (100, 100)):
+            matrix = json.loads(Game.generate_play_field(row, column, seed, playfields.ENGINE_SHUFFLE)[0])
+            self.assertEquals(len(matrix), row)
+            self.assertTrue(all(len(cells) == column for cells in matrix))
+
+            cards = [card for cells in matrix for card in cells]
+            pairs = (row * column) // 2
+            for card in range(pairs):
+                self.assertEquals(cards.count(card), 2)
+            self.assertEquals(cards.count(None), (row * column) % 2)
+
+            # Same seed gives the same board
+            self.assertEquals(matrix, json.loads(Game.generate_play_field(row, column, seed, playfields.ENGINE_SHUFFLE)[0]))
+
+    def test_board_cache(self):
+        playfield = [[0, 2, 5], [1, 4, 3], [3, 1, 4], [5, 2, 0]]
+        game = make(Game, seed=uuid.uuid4().hex, player=self.player_email, game_type=Game.MEMORY, active=True,
+                    finished=False, playfield=json.dumps(playfield))
+
+        for row, cards in enumerate(playfield):
+            for column, card in enumerate(cards):
+                self.assertEquals(game.get_card_id({'row': row, 'column': column}), card)
+        self.assertIn(game.board_cache_key(), board_cache)
+        with self.assertRaises(IndexError):
+            game.get_card_id({'row': 0, 'column': 3})
+
+        game.set_finished()
+        self.assertNotIn(game.board_cache_key(), board_cache)
+        self.assertEquals(game.get_card_id({'row': 3, 'column': 2}), 0)
+        self.assertNotIn(game.board_cache_key(), board_cache)
+
+        cache = playfields.BoardCache(2)
+        for key in range(3):
+            cache.set(key, playfields.Board.from_matrix(playfield))
+        self.assertEquals(len(cache), 2)
+        self.assertNotIn(0, cache)
+
+    def test_board_binary_format(self):
+        for matrix in ([[0, 2, 5], [1, 4, 3], [3, 1, 4], [5, 2, 0]], [[0, None, 0]], []):
+            board = playfields.Board.from_matrix(matrix)
+            data = board.to_bytes()
+            self.assertEquals(len(data), playfields.HEADER.size + 2 * len(board.cells))
+            self.assertEquals(playfields.Board.from_bytes(data).to_matrix(), matrix)
+
+        game = make(Game, seed=uuid.uuid4().hex, player=self.player_email, game_type=Game.MEMORY, active=True,
+                    finished=False, playfield=json.dumps([[0, 1], [1, 0]]))
+        game = Game.objects.get(pk=game.pk)
+        self.assertEquals(json.loads(game.playfield), [[0, 1], [1, 0]])
+        self.assertEquals(game.get_card_id({'row': 1, 'column': 0}), 1)
+
+        data = game.get_board().to_bytes()
+        for corrupt in (data[:-1], data[:3], b"\x09" + data[1:]):
+            with self.assertRaises(ValueError):
+                playfields.Board.from_bytes(corrupt)
+
+    def test_turn_counters(self):
+        game = make(Game, seed=uuid.uuid4().hex, player=self.player_email, game_type=Game.MEMORY, active=True,
+                    finished=False)
+        for is_match in (False, True, True):
+            game.turns.create(meta="{}", is_match=is_match)
+
+        stored = Game.objects.get(pk=game.pk)
+        for instance in (game, stored):
+            self.assertEquals(instance.turns_total, 3)
+            self.assertEquals(instance.turns_correct, 2)
+            self.assertEquals(instance.first_turn_at, game.turns.order_by("created").first().created)
+            self.assertEquals(instance.last_turn_at, game.turns.order_by("created").last().created)
+
+        with self.assertNumQueries(0):
+            score = stored.calculate_score()
+        self.assertTrue(score > 0)
+
+    def test_unique_highscores(self):
+        scores = (("a@test.com", "100"), ("a@test.com", "300"), ("b@test.com", "200"), ("a@test.com", "50"),
+                  ("c@test.com", "10"))
+        for player, score in scores:
+            game = make(Game, seed=uuid.uuid4().hex, player=player, game_type=Game.MEMORY, active=False,
+                        finished=True, score=Decimal(score))
+            PlayerBest.objects.record_game(game)
+
+        winners, enough_winners = Game.objects.get_unique_highscores(num=5)
+        self.assertFalse(enough_winners)
+        self.assertEquals([(game.player, game.score) for game in winners],
+                          [("a@test.com", Decimal("300")), ("b@test.com", Decimal("200")),
+                           ("c@test.com", Decimal("10"))])
+
+        winners, enough_winners = Game.objects.get_unique_highscores(num=2)
+        self.assertTrue(enough_winners)
+        self.assertEquals(len(winners), 2)
+        self.assertEquals(Game.objects.get_player_best_score("a@test.com").score, Decimal("300"))
+        self.assertIsNone(Game.objects.get_player_best_score("nobody@test.com"))
+
+    def test_turn_click_columns(self):
+        game = make(Game, seed=uuid.uuid4().hex, player=self.player_email, game_type=Game.MEMORY, active=True,
+                    finished=False, playfield=json.dumps([[0, 1], [1, 0]]))
+        moves = (([0, 0, 0], [0, 1, 1]), ([0, 0, 0], [1, 1, 0]), ([1, 0, 1], [1, 1, 0]))
+        for first, second in moves:
+            move = [dict(zip(('row', 'column', 'card'), first)), dict(zip(('row', 'column', 'card'), second))]
+            make(Turn, game=game, meta=json.dumps({'click': move}), is_match=first[2] == second[2])
+        Turn.from_move(game, [{'row': 0, 'column': 1, 'card': 1}, {'row': 1, 'column': 1, 'card': 0}], False, 0.8).save()
+
+        turn = game.turns.order_by("pk").first()
+        self.assertEquals((turn.first_row, turn.first_column, turn.first_card), (0, 0, 0))
+        self.assertEquals((turn.second_row, turn.second_column, turn.second_card), (0, 1, 1))
+        self.assertEquals(game.turns.order_by("pk").last().click_interval, 0.8)
+
+        self.assertEquals(list(Turn.objects.miss_rate_per_card()), [{'card': 0, 'turns': 2, 'misses': 1},
+                                                                    {'card': 1, 'turns': 2, 'misses': 2}])
+        self.assertEquals(list(Turn.objects.misses_per_square()), [{'row': 0, 'column': 1, 'misses': 1},
+                                                                   {'row': 1, 'column': 1, 'misses': 2}])
+
     def test_suspected_game(self):
         player = "test1@test.com"
         game = make(Game, seed=uuid.uuid4().hex, player=player, game_type=Game.MEMORY, active=False,
@@ -148,4 +284,947 @@ class TestCreateGameAndTurns(TestCase):
         total_time = game.turns.first().created - game.turns.last().created
         game.average_time = (total_time / game.turns.count()).total_seconds()
         self.assertTrue(SuspectedGame.is_game_suspected(game))
-        self.assertEquals(game.suspects.filter(player=player).count(), 1)
\ No newline at end of file
+        self.assertEquals(game.suspects.filter(player=player).count(), 1)
+
+    def test_disqualified_player(self):
+        for player, score in (("a@test.com", "300"), ("b@test.com", "200")):
+            game = make(Game, seed=uuid.uuid4().hex, player=player, game_type=Game.MEMORY, active=False,
+                        finished=True, score=Decimal(score), average_time=Decimal("0.5"))
+            PlayerBest.objects.record_game(game)
+
+        game = Game.objects.get(player="a@test.com")
+        self.assertTrue(SuspectedGame.is_game_suspected(game))
+        self.assertFalse(PlayerBest.objects.get(player="a@test.com").disqualified)
+        self.assertEquals(len(Game.objects.get_unique_highscores()[0]), 2)
+
+        self.assertTrue(SuspectedGame.is_game_suspected(game))
+        best = PlayerBest.objects.get(player="a@test.com")
+        self.assertEquals(best.suspected_games, 2)
+        self.assertTrue(best.disqualified)
+        self.assertEquals([game.player for game in Game.objects.get_unique_highscores()[0]], ["b@test.com"])
+
+        # Players without a finished game are counted as well
+        game = make(Game, seed=uuid.uuid4().hex, player="c@test.com", game_type=Game.MEMORY, active=False,
+                    finished=False, average_time=Decimal("0.5"))
+        SuspectedGame.is_game_suspected(game)
+        self.assertEquals(PlayerBest.objects.get(player="c@test.com").suspected_games, 1)
+        self.assertEquals(len(Game.objects.get_unique_highscores()[0]), 1)
+
+        # Their first finished game replaces the placeholder row, even with a score of 0
+        game = make(Game, seed=uuid.uuid4().hex, player="c@test.com", game_type=Game.MEMORY, active=False,
+                    finished=True, score=Decimal("0"))
+        self.assertTrue(PlayerBest.objects.record_game(game))
+        best = PlayerBest.objects.get(player="c@test.com")
+        self.assertEquals((best.game, best.suspected_games), (game, 1))
+
+
+class TestHighscoreCache(TestCase):
+
+    def setUp(self):
+        # Never the cache directory of the site, see gameness/testrunner.py
+        location = settings.CACHES[settings.HIGHSCORE_CACHE]["LOCATION"]
+        self.assertNotEqual(location, os.path.join(settings.BASE_DIR, "cache"))
+        highscores.highscore_cache().clear()
+        for i, score in enumerate(("500", "400", "300", "200", "100")):
+            game = make(Game, seed=uuid.uuid4().hex, player=f"{i}@test.com", game_type=Game.MEMORY, active=False,
+                        finished=True, score=Decimal(score))
+            PlayerBest.objects.record_game(game)
+
+    def test_highscore_page_reads_the_table_from_the_cache(self):
+        self.client.get(reverse('contest_contest'))
+        response = self.client.get(reverse('contest_highscore'))
+        self.assertEquals([row["player"] for row in response.context["unique_highscores"]],
+                          [f"{i}@test.com" for i in range(5)])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('contest_highscore'))
+        self.assertEquals(len(response.context["unique_highscores"]), 5)
+        leaderboard = 'ORDER BY "gameness_playerbest"."score" DESC'
+        self.assertFalse([query for query in queries if leaderboard in query['sql']])
+        # The page only shows the top list of the players, not the one of the games
+        self.assertNotIn("highscores", response.context)
+
+    def test_version_is_bumped_when_the_table_can_change(self):
+        highscores.get_unique_highscores()
+        version = highscores.current_version()
+
+        low = make(Game, seed=uuid.uuid4().hex, player="low@test.com", game_type=Game.MEMORY, active=False,
+                   finished=True, score=Decimal("50"))
+        self.assertFalse(highscores.game_finished(low, new_best=True, suspected=False))
+        self.assertFalse(highscores.game_finished(low, new_best=True, suspected=True))
+        self.assertEquals(highscores.current_version(), version)
+
+        self.assertTrue(highscores.game_finished(Game.objects.get(player="4@test.com"), new_best=False,
+                                                 suspected=True))
+        self.assertEquals(highscores.current_version(), version + 1)
+
+        high = make(Game, seed=uuid.uuid4().hex, player="high@test.com", game_type=Game.MEMORY, active=False,
+                    finished=True, score=Decimal("1000"))
+        PlayerBest.objects.record_game(high)
+        # Nothing is cached for the new version yet, any game bumps it
+        self.assertTrue(highscores.game_finished(high, new_best=True, suspected=False))
+        self.assertEquals(highscores.get_unique_highscores()[0]["player"], "high@test.com")
+        self.assertTrue(highscores.game_finished(high, new_best=True, suspected=False))
+
+
+class TestRanks(TestCase):
+
+    def setUp(self):
+        ranks.rank_index.loaded = False
+        for player, score in (("a", "500"), ("b", "400"), ("c", "400"), ("d", "100")):
+            self.finish(f"{player}@test.com", score)
+
+    def finish(self, player, score):
+        game = make(Game, seed=uuid.uuid4().hex, player=player, game_type=Game.MEMORY, active=False, finished=True,
+                    score=Decimal(score))
+        return PlayerBest.objects.record_game(game)
+
+    def test_rank_index(self):
+        index = ranks.RankIndex()
+        index.load([("a", 5), ("b", 4), ("c", 4), ("d", 1)])
+        self.assertEquals(index.rank("c"), (2, 4))
+        self.assertEquals(index.rank("d"), (4, 1))
+        self.assertIsNone(index.rank("x"))
+        self.assertEquals(index.position("c"), 3)
+        self.assertEquals([(row["rank"], row["player"]) for row in index.around(3, 1)], [(2, "b"), (2, "c"), (4, "d")])
+
+        index.update("d", 6)
+        index.update("a")
+        self.assertEquals(index.rank("d"), (1, 6))
+        self.assertEquals(len(index), 3)
+        self.assertEquals(index.around(10, 1), [])
+
+    def test_rank_view(self):
+        response = self.client.get(reverse('contest_rank'), {"player": "c@test.com", "radius": 1})
+        self.assertEquals(response.json(), {
+            "success": True, "player": "c@test.com", "rank": 2, "score": "400.000", "players": 4,
+            "around": [{"rank": 2, "player": "b@test.com", "score": "400.000"},
+                       {"rank": 2, "player": "c@test.com", "score": "400.000"},
+                       {"rank": 4, "player": "d@test.com", "score": "100.000"}]})
+        response = self.client.get(reverse('contest_rank'), {"rank": 4, "radius": 0})
+        self.assertEquals([row["player"] for row in response.json()["around"]], ["d@test.com"])
+        self.assertEquals(self.client.get(reverse('contest_rank'), {"rank": "x"}).status_code, 400)
+
+    def test_index_follows_the_leaderboard(self):
+        self.assertEquals(ranks.player_rank("d@test.com")["rank"], 4)
+        # Games finished by another worker are picked up by the next sync
+        self.finish("e@test.com", "450")
+        self.assertEquals(ranks.player_rank("d@test.com")["rank"], 4)
+        ranks.rank_index.synced_at -= settings.RANK_INDEX_REFRESH
+        self.assertEquals(ranks.player_rank("d@test.com")["rank"], 5)
+
+        # A game finished in this process updates the index right away
+        game = make(Game, seed=uuid.uuid4().hex, player="d@test.com", game_type=Game.MEMORY, active=False,
+                    finished=True, score=Decimal("1000"))
+        ranks.game_finished(game, PlayerBest.objects.record_game(game), False)
+        self.assertEquals(ranks.player_rank("d@test.com")["rank"], 1)
+        with self.settings(SUSPECTED_GAMES_LIMIT=0):
+            PlayerBest.objects.record_suspected_game("d@test.com")
+        ranks.game_finished(game, False, True)
+        self.assertEquals(ranks.player_rank("d@test.com"), {"rank": None, "score": None, "players": 4, "around": []})
+
+    def test_highscore_page_shows_the_rank(self):
+        self.client.get(reverse('contest_contest'))
+        session = self.client.session
+        session["player"] = "c@test.com"
+        session.save()
+        self.assertContains(self.client.get(reverse('contest_highscore')), "You are #2 of 4")
+
+
+class TestLeaderboard(TestCase):
+
+    def setUp(self):
+        for i, score in enumerate(("500", "400", "400", "400", "300", "100")):
+            game = make(Game, seed=uuid.uuid4().hex, player=f"{i % 5}@test.com", game_type=Game.MEMORY,
+                        active=False, finished=True, score=Decimal(score))
+            PlayerBest.objects.record_game(game)
+
+    def pages(self, mode, size):
+        pages, cursor = [], ""
+        while True:
+            response = self.client.get(reverse('contest_leaderboard'), {"mode": mode, "size": size, "cursor": cursor})
+            self.assertEquals(response.status_code, 200)
+            data = response.json()
+            pages.append([(row["score"], row["player"]) for row in data["results"]])
+            cursor = data["next"]
+            if cursor is None:
+                return pages
+
+    def test_pages_with_ties(self):
+        games = [(score, player) for score, player in Game.objects.get_highscores().order_by("-score", "id")
+                 .values_list("score", "player")]
+        pages = self.pages("games", 2)
+        self.assertEquals([len(page) for page in pages], [2, 2, 2])
+        self.assertEquals([row for page in pages for row in page], [(f"{score:.3f}", player) for score, player in games])
+
+        # Player 0 also played the 100, the 500 stays their best game
+        pages = self.pages("players", 3)
+        self.assertEquals(pages, [[("500.000", "0@test.com"), ("400.000", "1@test.com"), ("400.000", "2@test.com")],
+                                  [("400.000", "3@test.com"), ("300.000", "4@test.com")]])
+
+    def test_invalid_requests(self):
+        url = reverse('contest_leaderboard')
+        self.assertEquals(self.client.get(url, {"mode": "x"}).status_code, 400)
+        self.assertEquals(self.client.get(url, {"cursor": "garbage"}).status_code, 400)
+        cursor = leaderboard.encode_cursor("games", Decimal("400"), 1)
+        self.assertEquals(self.client.get(url, {"mode": "players", "cursor": cursor}).status_code, 400)
+        for mode in leaderboard.MODES:
+            for score, pk in (("1", 10 ** 30), ("1", -1), ("Infinity", 1), ("-Infinity", 1), ("NaN", 1)):
+                cursor = leaderboard.encode_cursor(mode, score, pk)
+                self.assertEquals(self.client.get(url, {"mode": mode, "cursor": cursor}).status_code, 400)
+            # The largest id and scores beyond the range of the score column are valid cursors
+            for score, pk in (("1", leaderboard.MAX_ID), ("1e30", 1), ("-1e30", 1)):
+                response = self.client.get(url, {"mode": mode, "cursor": leaderboard.encode_cursor(mode, score, pk)})
+                self.assertEquals(response.status_code, 200)
+
+
+class GameClientMixin(object):
+    """
+    Starts a game on a 2x2 board, [[0, 1], [1, 0]], and clicks on it through ContestGameView
+    """
+
+    def setUp(self):
+        caches[settings.GAME_STATE_CACHE].clear()
+        self.client.get(reverse('contest_contest'))
+        self.game = Game.objects.last()
+        self.game.playfield = json.dumps([[0, 1], [1, 0]])
+        self.game.save()
+        self.url = reverse('contest_game_view')
+
+    def click(self, row, column):
+        response = self.client.post(self.url, data={'click': json.dumps({'row': row, 'column': column})})
+        self.assertEquals(response.status_code, 200)
+        return response.json()
+
+
+class TestMetrics(GameClientMixin, TestCase):
+
+    def test_histogram_render(self):
+        histogram = metrics.Histogram("test_seconds", "Test", ("name",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, name='a "b"')
+        histogram.observe(0.5, name='a "b"')
+        histogram.observe(5, name='a "b"')
+        self.assertEquals(histogram.render().splitlines(), [
+            '# HELP test_seconds Test',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{name="a \\"b\\"",le="0.1"} 1',
+            'test_seconds_bucket{name="a \\"b\\"",le="1.0"} 2',
+            'test_seconds_bucket{name="a \\"b\\"",le="+Inf"} 3',
+            'test_seconds_sum{name="a \\"b\\""} 5.55',
+            'test_seconds_count{name="a \\"b\\""} 3',
+        ])
+
+    def test_metrics_endpoint(self):
+        self.click(0, 0)
+        self.click(1, 1)
+        self.click(0, 1)
+        self.assertTrue(self.click(1, 0)['completed'])
+        playfields.generate_board(2, 3, uuid.uuid4().hex) # What the playfield pool does in its thread
+
+        url = reverse('metrics')
+        self.assertEquals(url, "/metrics/")
+        self.assertEquals(self.client.get(url).status_code, 302) # To the admin login
+        with self.settings(METRICS_ALLOWED_IPS=("127.0.0.1",)):
+            self.assertEquals(self.client.get(url).status_code, 200)
+        self.client.force_login(make(User, is_staff=True, is_active=True))
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith("text/plain; version=0.0.4"))
+        lines = response.content.decode().splitlines()
+        for prefix in ('gameness_request_duration_seconds_count{view="contest_game_view",method="POST"}',
+                       'gameness_requests_total{view="contest_game_view",method="POST",status="200"}',
+                       'gameness_db_queries_total{view="contest_game_view"}',
+                       'gameness_session_save_seconds_count{view="contest_game_view"}',
+                       'gameness_timer_seconds_count{name="calculate_score"}',
+                       'gameness_timer_seconds_count{name="generate_play_field"}',
+                       'gameness_timer_seconds_count{name="game_view.play_click"}',
+                       'gameness_playfield_pool_boards_total{result="hit"}'):
+            self.assertTrue([line for line in lines if line.startswith(prefix + " ")], prefix)
+
+
+class TestLogQueue(TestCase):
+
+    def record(self, level=logging.INFO, lineno=1):
+        return logging.LogRecord("gameness.test", level, "models.py", lineno, "Message %s", ("x",), None)
+
+    def test_sample_filter(self):
+        self.assertFalse(logqueue.SampleFilter(rate=0.0).filter(self.record()))
+        self.assertTrue(logqueue.SampleFilter(rate=0.0).filter(self.record(logging.WARNING)))
+        self.assertTrue(logqueue.SampleFilter(rate=1.0, max_level="WARNING").filter(self.record(logging.WARNING)))
+
+    def test_rate_limit_filter(self):
+        limit = logqueue.RateLimitFilter(rate=2, per=60)
+        self.assertEquals([limit.filter(self.record()) for i in range(5)], [True, True, False, False, False])
+        self.assertTrue(limit.filter(self.record(lineno=2)))
+
+        with mock.patch("gameness.logqueue.time.monotonic", return_value=logqueue.time.monotonic() + 61):
+            record = self.record()
+            self.assertTrue(limit.filter(record))
+        self.assertEquals(record.getMessage(), "Message x (3 similar messages suppressed)")
+
+    def test_records_are_written_by_the_listener(self):
+        queue = Queue(2)
+        target = BufferingHandler(10)
+        handler = logqueue.AsyncQueueHandler(queue)
+        logger = logging.getLogger("test.logqueue")
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        for i in range(4):
+            logger.warning("Message %s", i)
+        self.assertEquals((queue.qsize(), handler.dropped), (2, 2))
+
+        listener = QueueListener(queue, target)
+        listener.start()
+        listener.stop()
+        logger.warning("Message %s", 4)
+        self.assertEquals([record.getMessage() for record in target.buffer], ["Message 0", "Message 1"])
+        self.assertEquals([record.getMessage() for record in queue.queue],
+                          ["Message 4", "Dropped 2 log records, the log queue was full."])
+
+
+@override_settings(GAME_STATE_ENGINE="cache")
+class TestWriteBehindGameState(GameClientMixin, TransactionTestCase):
+
+    def test_turns_are_written_when_the_game_completes(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.click(0, 0)
+            self.assertFalse(self.click(0, 1)['match'])
+            self.click(0, 0)
+            self.assertTrue(self.click(1, 1)['match'])
+        writes = [query['sql'] for query in queries if query['sql'].startswith(("INSERT", "UPDATE"))]
+        self.assertEquals(writes, [])
+        self.assertEquals(self.game.turns.count(), 0)
+
+        self.click(0, 1)
+        response_json = self.click(1, 0)
+        self.assertTrue(response_json['completed'])
+
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertTrue(game.finished)
+        self.assertEquals((game.turns_total, game.turns_correct), (3, 2))
+        self.assertEquals(game.turns.count(), 3)
+        self.assertEquals(game.turns.filter(is_match=True).count(), 2)
+        self.assertFalse(game.turns.filter(Q(second_card__isnull=True) | Q(click_interval__isnull=True)).exists())
+        self.assertEquals(game.last_turn_at, game.turns.order_by("created").last().created)
+        self.assertEquals(game.score, game.calculate_score().quantize(Decimal('0.001')))
+
+    def test_idle_game_is_flushed(self):
+        self.click(0, 0)
+        self.click(1, 1)
+
+        call_command("flush_game_states", idle=0, stdout=StringIO())
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEquals((game.turns_total, game.turns_correct), (1, 1))
+        self.assertEquals(game.turns.count(), 1)
+        self.assertFalse(game.finished)
+
+        # The state is rebuilt from the database and the game can be completed
+        self.click(0, 1)
+        self.assertTrue(self.click(1, 0)['completed'])
+        self.assertEquals(Game.objects.get(pk=self.game.pk).turns.count(), 2)
+
+
+    def test_state_is_flushed_once(self):
+        def assertFinished(turns):
+            game = Game.objects.get(pk=self.game.pk)
+            self.assertTrue(game.finished)
+            self.assertEquals((game.turns_total, game.turns_correct), (turns, 2))
+            self.assertEquals(game.turns.count(), turns)
+
+        # flush_game writes the state while a click which loaded it finishes the game
+        self.click(0, 0)
+        self.click(1, 1)
+        state = gamestate.CacheGameState.load(Game.objects.get(pk=self.game.pk))
+        self.assertTrue(gamestate.flush_game(self.game.pk))
+        state.play({"row": 0, "column": 1})
+        state.play({"row": 1, "column": 0})
+        state.finish()
+        assertFinished(2)
+
+        # flush_game loaded the state before a click finished the game
+        self.setUp()
+        self.click(0, 0)
+        self.click(1, 1)
+        state = gamestate.CacheGameState.load(Game.objects.get(pk=self.game.pk))
+        self.click(0, 1)
+        self.assertTrue(self.click(1, 0)["completed"])
+        self.assertFalse(state.flush())
+        assertFinished(2)
+
+        # A click which loaded the state before flush_game wrote it saves it back
+        self.setUp()
+        self.click(0, 0)
+        self.click(0, 1)
+        state = gamestate.CacheGameState.load(Game.objects.get(pk=self.game.pk))
+        self.assertTrue(gamestate.flush_game(self.game.pk))
+        state.play({"row": 0, "column": 0})
+        state.play({"row": 1, "column": 1})
+        state.save()
+        self.click(0, 1)
+        self.assertTrue(self.click(1, 0)["completed"])
+        assertFinished(3)
+
+
+@override_settings(GAME_STATE_ENGINE="hybrid")
+class TestHybridGameState(GameClientMixin, TestCase):
+
+    def test_clicks_do_not_write_the_session(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.click(0, 0)
+            self.assertFalse(self.click(0, 1)['match'])
+        writes = [query['sql'] for query in queries if query['sql'].startswith(("INSERT", "UPDATE"))]
+        self.assertFalse([sql for sql in writes if "django_session" in sql])
+        self.assertEquals(self.game.turns.count(), 1)
+
+        self.click(0, 0)
+        self.click(1, 1)
+        self.click(0, 1)
+        self.assertTrue(self.click(1, 0)['completed'])
+        self.assertEquals(Game.objects.get(pk=self.game.pk).turns_total, 3)
+
+
+class TestMatchedPairs(GameClientMixin, TestCase):
+
+    def illegal_click(self, row, column):
+        response = self.client.post(self.url, data={'click': json.dumps({'row': row, 'column': column})})
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response.json()["msg"], "Illegal move.")
+
+    def test_found_pair_can_not_be_matched_again(self):
+        for engine in ("session", "hybrid", "cache"):
+            with self.subTest(engine=engine), self.settings(GAME_STATE_ENGINE=engine):
+                self.setUp()
+                self.click(0, 0)
+                self.assertTrue(self.click(1, 1)['match'])
+
+                # Neither as the first nor as the second click of a turn, the first click stays pending
+                self.illegal_click(0, 0)
+                self.click(0, 1)
+                self.illegal_click(1, 1)
+                self.assertTrue(Game.objects.get(pk=self.game.pk).active)
+
+                self.assertTrue(self.click(1, 0)['completed'])
+                game = Game.objects.get(pk=self.game.pk)
+                self.assertEquals((game.turns_total, game.turns_correct), (2, 2))
+
+    def test_rematch_does_not_complete_the_game(self):
+        self.click(0, 0)
+        self.click(1, 1)
+        response = self.client.post(reverse('contest_game_batch_view'), data={'clicks': json.dumps(
+            [{'row': 0, 'column': 0}, {'row': 1, 'column': 1}, {'row': 0, 'column': 0}, {'row': 1, 'column': 1}])})
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response.json()["index"], 0)
+
+        # The found pairs are read from the turns when the cached state is lost
+        with self.settings(GAME_STATE_ENGINE="hybrid"):
+            caches[settings.GAME_STATE_CACHE].clear()
+            self.illegal_click(1, 1)
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertTrue(game.active)
+        self.assertEquals((game.turns_total, game.turns_correct), (1, 1))
+
+
+class TestBatchGameView(TestCase):
+
+    def setUp(self):
+        self.client.get(reverse('contest_contest'))
+        self.game = Game.objects.last()
+        self.game.playfield = json.dumps([[0, 1], [1, 0]])
+        self.game.save()
+        self.url = reverse('contest_game_batch_view')
+
+    def post(self, clicks):
+        return self.client.post(self.url, data={'clicks': json.dumps(
+            [{'row': row, 'column': column} for row, column in clicks])})
+
+    def test_batch_of_clicks(self):
+        response = self.post([(0, 0), (0, 1)])
+        self.assertEquals(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEquals(results[0], {'success': True, 'click': [{'row': 0, 'column': 0, 'card': 0}]})
+        self.assertEquals(results[1], {'success': True, 'match': False,
+                                       'click': [{'row': 0, 'column': 0, 'card': 0},
+                                                 {'row': 0, 'column': 1, 'card': 1}]})
+
+        # Clicks after the game has been completed are ignored
+        results = self.post([(0, 0), (1, 1), (0, 1), (1, 0), (0, 0)]).json()['results']
+        self.assertEquals(len(results), 4)
+        self.assertTrue(results[-1]['completed'])
+
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertTrue(game.finished)
+        self.assertEquals(game.turns.count(), 3)
+        self.assertFalse(game.turns.filter(click_interval__isnull=True).exists())
+
+    def test_invalid_batch_plays_nothing(self):
+        response = self.post([(0, 0), (1, 1), (0, 1), (0, 1)])
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(response.json()['index'], 3)
+        self.assertEquals(self.game.turns.count(), 0)
+        self.assertEquals(Game.objects.get(pk=self.game.pk).turns_total, 0)
+
+        self.assertEquals(self.post([(0, 0), (5, 5)]).status_code, 400)
+        self.assertEquals(self.post([]).status_code, 400)
+
+        # The pending click from the failed batches was not kept
+        results = self.post([(0, 0), (1, 1)]).json()['results']
+        self.assertTrue(results[1]['match'])
+
+
+@skipUnless(connection.vendor == "sqlite", "Query plans are checked on SQLite")
+class TestQueryPlans(TestCase):
+    """
+    Every GameManager query path has to be answered from an index, never by scanning a whole table.
+    """
+
+    def setUp(self):
+        self.player = "test1@test.com"
+        for finished in (False, True):
+            game = make(Game, seed=uuid.uuid4().hex, player=self.player, game_type=Game.MEMORY, active=not finished,
+                        finished=finished, score=Decimal("100"))
+            game.turns.create(meta="{}", is_match=True)
+            PlayerBest.objects.record_game(game)
+
+    def assertIndexedQueries(self, method, *args):
+        with CaptureQueriesContext(connection) as queries:
+            result = method(*args)
+            if hasattr(result, "__iter__"):
+                list(result)
+        self.assertTrue(queries.captured_queries)
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plan = [row[-1] for row in cursor.fetchall()]
+                scans = [step for step in plan if step.startswith("SCAN") and " USING " not in step]
+                self.assertEquals(scans, [], f"{method.__name__} scans a table: {query['sql']} {plan}")
+
+    def test_manager_methods_use_indexes(self):
+        self.assertIndexedQueries(Game.objects.active_game, self.player)
+        self.assertIndexedQueries(Game.objects.player_has_active_games, self.player)
+        self.assertIndexedQueries(Game.objects.stop_active_games_for_player, self.player)
+        self.assertIndexedQueries(Game.objects.get_highscores)
+        self.assertIndexedQueries(Game.objects.get_player_best_score, self.player)
+        self.assertIndexedQueries(Game.objects.get_unique_highscores)
+
+    def test_leaderboard_pages_use_indexes(self):
+        for mode in leaderboard.MODES:
+            self.assertIndexedQueries(leaderboard.page, mode, None, 1)
+            self.assertIndexedQueries(leaderboard.page, mode, leaderboard.encode_cursor(mode, Decimal("100"), 1), 1)
+
+    def test_turns_use_indexes(self):
+        game = Game.objects.get(player=self.player, finished=True)
+        self.assertIndexedQueries(lambda: game.turns.order_by("created"))
+
+
+class TestPlayfieldPool(TestCase):
+
+    def test_pop_and_refill(self):
+        pool = PlayfieldPool(2, [(2, 3)])
+        pool.start = lambda: None # Refill synchronously in the test
+        self.assertIsNone(pool.pop(2, 3))
+        self.assertIsNone(pool.pop(4, 4))
+        self.assertEquals(pool.refill(), 4)
+        self.assertEquals(pool.refill(), 0)
+
+        seed, engine, board_data = pool.pop(4, 4)
+        self.assertEquals(playfields.Board.from_bytes(board_data).to_matrix(),
+                          json.loads(Game.generate_play_field(4, 4, seed, engine)[0]))
+        self.assertEquals(pool.stats(), {"hits": 1, "misses": 2, "ready": {"2x3": 2, "4x4": 1}})
+
+        self.assertIsNone(PlayfieldPool(0).pop(2, 3))
+
+    @staticmethod
+    def wait_for_boards(pool, count, timeout=5.0):
+        """
+        :return: the seeds of the ready boards once there are count of them, None on a timeout
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with pool._lock:
+                boards = list(pool._boards[(2, 3)])
+            if len(boards) >= count:
+                return set(seed for seed, engine, board_data in boards)
+            time.sleep(0.01)
+        return None
+
+    @skipUnless(hasattr(os, "fork"), "Needs os.fork")
+    def test_warm_and_fork(self):
+        # A pool which never started its thread does not start one in a forked child
+        idle = PlayfieldPool(2, [(2, 3)])
+        idle._after_fork()
+        self.assertIsNone(idle._thread)
+
+        pool = PlayfieldPool(2, [(2, 3)])
+        os.register_at_fork(after_in_child=pool._after_fork)
+        pool.warm()
+        parent = pool._thread
+        self.assertTrue(parent.is_alive())
+        seeds = self.wait_for_boards(pool, 2)
+        self.assertEquals(len(seeds), 2)
+
+        pid = os.fork()
+        if pid == 0:
+            # The child drops the thread and the boards of its parent and refills the pool with a thread of its own,
+            # it reports through its exit status
+            status = 1
+            try:
+                thread = pool._thread
+                if thread is not None and thread is not parent and thread.is_alive():
+                    child_seeds = self.wait_for_boards(pool, 2)
+                    status = 0 if child_seeds and not child_seeds & seeds else 2
+            finally:
+                os._exit(status)
+        self.assertEquals(os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]), 0)
+        self.assertEquals(self.wait_for_boards(pool, 2), seeds)
+
+    def test_contest_view_uses_pool(self):
+        seed = uuid.uuid4().hex
+        board_data = playfields.Board.from_matrix([[0, 0]]).to_bytes()
+        with mock.patch("gameness.views.playfield_pool.pop", return_value=(seed, playfields.ENGINE_LEGACY, board_data)):
+            self.client.get(reverse('contest_contest'))
+        game = Game.objects.last()
+        self.assertEquals((game.seed, game.engine, game.playfield), (seed, playfields.ENGINE_LEGACY, "[[0, 0]]"))
+
+
+class TestVerifyGames(TestCase):
+
+    def play_game(self):
+        """
+        Play a game on the board generated from its seed, finding the pairs in card order
+        """
+        self.client.get(reverse('contest_contest'))
+        game = Game.objects.last()
+        board = game.get_board()
+        squares = {}
+        for square, card in enumerate(board.cells):
+            squares.setdefault(card, []).append(divmod(square, board.columns))
+        for card in sorted(squares):
+            for row, column in squares[card]:
+                self.client.post(reverse('contest_game_view'),
+                                 data={'click': json.dumps({'row': row, 'column': column})})
+        return Game.objects.get(pk=game.pk)
+
+    def verify(self, **options):
+        out = StringIO()
+        call_command("verify_games", stdout=out, **options)
+        return out.getvalue()
+
+    def test_tampered_games_are_flagged(self):
+        honest, tampered, wrong_turn = self.play_game(), self.play_game(), self.play_game()
+        self.assertTrue(honest.finished)
+        Game.objects.filter(pk=tampered.pk).update(score=F('score') + 100)
+        Turn.objects.filter(pk=wrong_turn.turns.first().pk).update(is_match=False)
+
+        output = self.verify(workers=1)
+        self.assertIn("Verified 3 games", output)
+        self.assertIn("2 did not verify", output)
+        self.assertIn(f"Game {tampered.pk} by {tampered.player}: the score", output)
+        self.assertIn(f"Game {wrong_turn.pk} by {wrong_turn.player}: turn 1 is recorded as a miss", output)
+        flagged = SuspectedGame.objects.filter(reason__startswith="Replay verification failed")
+        self.assertEquals(sorted(flagged.values_list("game_id", flat=True)), [tampered.pk, wrong_turn.pk])
+
+        # Already flagged games are not flagged twice
+        self.verify(workers=1, from_id=tampered.pk)
+        self.assertEquals(flagged.count(), 2)
+
+    def test_parallel_dry_run(self):
+        games = [self.play_game() for i in range(4)]
+        # A 2x3 board has only 90 layouts, take a seed which is sure to give another one
+        seed = next(seed for seed in iter(lambda: uuid.uuid4().hex, None)
+                    if playfields.generate_board(2, 3, seed, games[1].engine).cells != games[1].get_board().cells)
+        Game.objects.filter(pk=games[1].pk).update(seed=seed)
+
+        output = self.verify(workers=2, chunk_size=1, dry_run=True)
+        self.assertIn("Verified 4 games", output)
+        self.assertIn(f"Game {games[1].pk} by {games[1].player}: the board does not match the seed", output)
+        self.assertFalse(SuspectedGame.objects.filter(reason__startswith="Replay verification failed").exists())
+
+
+class TestExport(TestCase):
+
+    def setUp(self):
+        self.games = [make(Game, seed=uuid.uuid4().hex, player=f"{i}@test.com", game_type=Game.MEMORY, active=False,
+                           finished=True, score=Decimal("100.5")) for i in range(5)]
+        make(SuspectedGame, game=self.games[0], player=self.games[0].player, reason='Too "fast",\nreally')
+
+    def test_rows_are_read_in_batches(self):
+        with self.assertNumQueries(3):
+            rows = list(export.rows("games", batch_size=2))
+        self.assertEquals([row[0] for row in rows], [game.pk for game in self.games])
+        self.assertEquals([row[0] for row in export.rows("games", after=self.games[2].pk)],
+                          [game.pk for game in self.games[3:]])
+
+    def test_export_view(self):
+        url = reverse('export', kwargs={'dataset': 'suspected', 'format': 'csv'})
+        self.assertEquals(self.client.get(url).status_code, 302)
+
+        staff = make(User, is_staff=True, is_active=True)
+        self.client.force_login(staff)
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        rows = list(csv.reader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEquals(rows[0], ["id", "game_id", "player", "reason", "created"])
+        self.assertEquals(rows[1][2:4], ["0@test.com", 'Too "fast",\nreally'])
+
+        response = self.client.get(reverse('export', kwargs={'dataset': 'games', 'format': 'jsonl'}),
+                                   HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEquals(response["Content-Encoding"], "gzip")
+        lines = gzip.decompress(b"".join(response.streaming_content)).decode().splitlines()
+        self.assertEquals(len(lines), 5)
+        self.assertEquals(json.loads(lines[0])["score"], "100.500")
+
+        response = self.client.get(reverse('export', kwargs={'dataset': 'sessions', 'format': 'csv'}))
+        self.assertEquals(response.status_code, 404)
+
+    def test_export_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "games.csv.gz")
+            out = StringIO()
+            call_command("export_data", "games", output=path, batch_size=2, stdout=out)
+            self.assertIn("Exported 5 games", out.getvalue())
+            with gzip.open(path, "rt") as output:
+                rows = list(csv.reader(output))
+        self.assertEquals(len(rows), 6)
+        self.assertEquals(rows[1][1], "0@test.com")
+
+
+class TestPruneGames(TestCase):
+
+    def game(self, days, **kwargs):
+        game = make(Game, seed=uuid.uuid4().hex, player="old@test.com", game_type=Game.MEMORY, **kwargs)
+        make(Turn, game=game, meta=json.dumps({'click': [{'row': 0, 'column': 0, 'card': 0},
+                                                         {'row': 0, 'column': 1, 'card': 0}]}), is_match=True)
+        Game.objects.filter(pk=game.pk).update(created=timezone.now() - datetime.timedelta(days=days))
+        return game
+
+    def test_prune_games(self):
+        abandoned = self.game(2, active=False, finished=False)
+        recent = self.game(0, active=True, finished=False)
+        suspected = self.game(2, active=False, finished=False)
+        make(SuspectedGame, game=suspected, player=suspected.player)
+        expired = [self.game(400, active=False, finished=True, score=Decimal(score)) for score in ("10", "20", "30")]
+        PlayerBest.objects.record_game(expired[-1])
+        kept = self.game(10, active=False, finished=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            out = StringIO()
+            call_command("prune_games", dry_run=True, archive_dir=directory, stdout=out)
+            self.assertIn("1 abandoned games would be deleted", out.getvalue())
+            self.assertIn("2 finished games would be archived", out.getvalue())
+
+            out = StringIO()
+            call_command("prune_games", archive_dir=directory, batch_size=1, pause=0, stdout=out)
+            self.assertIn("Deleted 1 abandoned games.", out.getvalue())
+            self.assertIn("Archived 2 finished games", out.getvalue())
+            [archive] = os.listdir(directory)
+            with gzip.open(os.path.join(directory, archive), "rt") as output:
+                games = [json.loads(line) for line in output]
+
+        self.assertEquals([game["id"] for game in games], [expired[0].pk, expired[1].pk])
+        self.assertEquals(games[0]["turns"][0]["first_card"], 0)
+        self.assertEquals(playfields.Board.from_bytes(base64.b64decode(games[0]["board_data"])).cells,
+                          expired[0].get_board().cells)
+        self.assertFalse(Game.objects.filter(pk=abandoned.pk).exists())
+        self.assertEquals(sorted(Game.objects.values_list("pk", flat=True)),
+                          sorted([recent.pk, suspected.pk, expired[-1].pk, kept.pk]))
+        self.assertEquals(Turn.objects.count(), 4)
+
+    def test_game_suspected_while_pruned(self):
+        expired = [self.game(400, active=False, finished=True) for i in range(3)]
+        archive_games = retention.archive_games
+
+        def suspect(ids, output):
+            # verify_games flags a game of the batch between the archive and the delete
+            count = archive_games(ids, output)
+            make(SuspectedGame, game_id=expired[1].pk, player=expired[1].player)
+            return count
+
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch("gameness.retention.archive_games", side_effect=suspect):
+                self.assertEquals(retention.archive_expired(os.path.join(directory, "first.jsonl.gz")), 2)
+            self.assertEquals(retention.archive_expired(os.path.join(directory, "second.jsonl.gz")), 0)
+            self.assertEquals(os.listdir(directory), ["first.jsonl.gz"])
+        self.assertEquals(list(Game.objects.values_list("pk", flat=True)), [expired[1].pk])
+        self.assertEquals(Turn.objects.get().game_id, expired[1].pk)
+
+
+class TestContestAssets(TestCase):
+
+    def test_contest_page(self):
+        player = "best@test.com"
+        for score in ("300", "100"):
+            game = make(Game, seed=uuid.uuid4().hex, player=player, game_type=Game.MEMORY, active=False,
+                        finished=True, score=Decimal(score))
+            PlayerBest.objects.record_game(game)
+
+        with mock.patch("gameness.views.choice", return_value=player):
+            response = self.client.get(reverse('contest_contest'))
+        game_data = json.loads(response.context["game_data"])
+        self.assertEquals(game_data, {"success": True, "best_score": "300.000", "rows": 2, "cols": 3})
+        self.assertContains(response, reverse('contest_game_assets', kwargs={'rows': 2, 'columns': 3}))
+
+    def test_board_size_is_picked_from_the_allow_list(self):
+        response = self.client.get(reverse('contest_contest'), {"board": "64x64"})
+        self.assertEquals(json.loads(response.context["game_data"])["rows"], 64)
+        board = Game.objects.get(pk=self.client.session["game"]).get_board()
+        self.assertEquals((board.rows, board.columns, board.pairs), (64, 64, 2048))
+        self.assertContains(response, reverse('contest_game_assets', kwargs={'rows': 64, 'columns': 64}))
+
+        self.assertEquals(self.client.get(reverse('contest_contest'), {"board": "5x5"}).status_code, 404)
+        self.assertEquals(self.client.get(reverse('contest_contest'), {"board": "x"}).status_code, 404)
+        misses = assets.game_manifest.cache_info().misses
+        self.assertEquals(self.client.get(reverse('contest_game_assets', kwargs={'rows': 5, 'columns': 5}))
+                          .status_code, 404)
+        self.assertEquals(assets.game_manifest.cache_info().misses, misses)
+
+    def test_assets_are_revalidated(self):
+        assets.game_manifest.cache_clear()
+        url = reverse('contest_game_assets', kwargs={'rows': 2, 'columns': 3})
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b"var gameAssets = {"))
+        self.assertIn("max-age=", response["Cache-Control"])
+        self.assertEquals(response["ETag"], f'"{assets.game_manifest(2, 3).etag}"')
+
+        self.assertEquals(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.assertEquals(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 304)
+        self.assertEquals(assets.game_manifest.cache_info().misses, 1)
+
+        # Bigger boards reuse the pieces
+        manifest = json.loads(self.client.get(reverse('contest_game_assets', kwargs={'rows': 6, 'columns': 6}))
+                              .content.decode()[len("var gameAssets = "):-2])
+        self.assertEquals(len(manifest["pieces"]), 18)
+        self.assertEquals(manifest["pieces"][10], manifest["pieces"][0])
+        misses = assets.game_manifest.cache_info().misses
+        self.assertEquals(self.client.get(reverse('contest_game_assets', kwargs={'rows': 65, 'columns': 2}))
+                          .status_code, 404)
+        self.assertEquals(self.client.get(reverse('contest_game_assets', kwargs={'rows': 1000, 'columns': 1000}))
+                          .status_code, 404)
+        # Nothing was built for the unknown boards
+        self.assertEquals(assets.game_manifest.cache_info().misses, misses)
+        self.assertRaises(ValueError, assets.game_manifest, 1000, 1000)
+
+
+@mock.patch("gameness.db.time.sleep")
+class TestDatabaseLocks(GameClientMixin, TransactionTestCase):
+
+    def test_retry_on_lock(self, sleep):
+        function = mock.Mock(side_effect=[OperationalError("database is locked")] * 2 + ["done"])
+        on_retry = mock.Mock()
+        self.assertEquals(db.retry_on_lock(function, on_retry=on_retry)(), "done")
+        self.assertEquals(function.call_count, 3)
+        self.assertEquals(on_retry.call_count, 2)
+        self.assertEquals(sleep.call_count, 2)
+
+        # Bounded, other errors and errors inside a transaction are raised right away
+        function = mock.Mock(side_effect=OperationalError("database is locked"))
+        self.assertRaises(OperationalError, db.retry_on_lock(function))
+        self.assertEquals(function.call_count, settings.DB_LOCK_RETRIES + 1)
+        function = mock.Mock(side_effect=OperationalError("no such table: x"))
+        self.assertRaises(OperationalError, db.retry_on_lock(function))
+        self.assertEquals(function.call_count, 1)
+        function = mock.Mock(side_effect=OperationalError("database is locked"))
+        with transaction.atomic():
+            self.assertRaises(OperationalError, db.retry_on_lock(function))
+        self.assertEquals(function.call_count, 1)
+
+    def test_click_is_retried(self, sleep):
+        update_game_counters = Turn.update_game_counters
+        failures = [OperationalError("database is locked")]
+
+        def locked(turn):
+            # The turn has been inserted when the database turns out to be locked
+            if failures:
+                raise failures.pop()
+            update_game_counters(turn)
+
+        self.click(0, 0)
+        with mock.patch.object(Turn, "update_game_counters", autospec=True, side_effect=locked):
+            self.assertTrue(self.click(0, 1)["success"])
+        self.assertEquals(sleep.call_count, 1)
+        self.assertEquals(Turn.objects.filter(game=self.game).count(), 1)
+        self.game.refresh_from_db()
+        self.assertEquals(self.game.turns_total, 1)
+
+    def test_finishing_click_is_retried(self, sleep):
+        record_game = PlayerBestManager.record_game
+
+        for engine in ("session", "hybrid", "cache"):
+            with self.subTest(engine=engine), self.settings(GAME_STATE_ENGINE=engine):
+                self.setUp()
+                for row, column in ((0, 0), (1, 1), (0, 1)):
+                    self.click(row, column)
+                failures = [OperationalError("database is locked")]
+
+                def locked(manager, game):
+                    # The game has been written as finished when the database turns out to be locked
+                    if failures:
+                        raise failures.pop()
+                    return record_game(manager, game)
+
+                with mock.patch.object(PlayerBestManager, "record_game", autospec=True, side_effect=locked):
+                    self.assertTrue(self.click(1, 0)["completed"])
+                game = Game.objects.get(pk=self.game.pk)
+                self.assertTrue(game.finished)
+                self.assertEquals((game.turns_total, game.turns_correct), (2, 2))
+                self.assertEquals(game.turns.count(), 2)
+                self.assertNotIn("game", self.client.session)
+                self.assertNotIn("click", self.client.session)
+                self.assertIsNone(caches[settings.GAME_STATE_CACHE].get(gamestate.CacheGameState.cache_key(game.pk)))
+                self.assertIsNone(caches[settings.GAME_STATE_CACHE].get(gamestate.HybridGameState.cache_key(game.pk)))
+
+    def test_failed_finishing_click_keeps_the_game(self, sleep):
+        for engine in ("session", "hybrid", "cache"):
+            with self.subTest(engine=engine), self.settings(GAME_STATE_ENGINE=engine):
+                self.setUp()
+                for row, column in ((0, 0), (1, 1), (0, 1)):
+                    self.click(row, column)
+                with mock.patch.object(PlayerBestManager, "record_game", autospec=True,
+                                       side_effect=OperationalError("database is locked")):
+                    self.assertRaises(OperationalError, self.client.post, self.url,
+                                      data={'click': json.dumps({'row': 1, 'column': 0})})
+                self.assertEquals(self.client.session["game"], self.game.pk)
+                self.assertTrue(Game.objects.get(pk=self.game.pk).active)
+
+                # The pending click survived, the game can be finished once the database is free
+                self.assertTrue(self.click(1, 0)["completed"])
+                self.assertEquals(Game.objects.get(pk=self.game.pk).turns.count(), 2)
+
+    def test_highscores_are_invalidated_after_the_commit(self, sleep):
+        with mock.patch("gameness.highscores.bump_version") as bump_version:
+            with transaction.atomic():
+                for row, column in ((0, 0), (1, 1), (0, 1), (1, 0)):
+                    result = self.click(row, column)
+                self.assertTrue(result["completed"])
+                bump_version.assert_not_called()
+            bump_version.assert_called_once_with()
+
+    def test_rank_index_is_updated_after_the_commit(self, sleep):
+        ranks.rank_index.loaded = False
+        self.addCleanup(setattr, ranks.rank_index, "loaded", False)
+        ranks.get_index()
+        with transaction.atomic():
+            for row, column in ((0, 0), (1, 1), (0, 1), (1, 0)):
+                self.click(row, column)
+            self.assertIsNone(ranks.rank_index.rank(self.game.player))
+        self.assertEquals(ranks.rank_index.rank(self.game.player)[0], 1)
+
+    def test_configure_sqlite(self, sleep):
+        db.configure_sqlite(sender=None, connection=connection)
+        with connection.cursor() as cursor:
+            self.assertEquals(cursor.execute("PRAGMA synchronous").fetchone()[0], 1) # NORMAL
+
+
+class TestLoadTest(TransactionTestCase):
+
+
+    def test_loadtest_plays_complete_games(self):
+        # One player, the in-memory test database does not cope with concurrent writers
+        out = StringIO()
+        call_command("loadtest", players=1, games=3, stdout=out)
+        output = out.getvalue()
+        self.assertIn("3 games and", output)
+        self.assertNotIn("Failed games", output)
+        self.assertEquals(Game.objects.filter(finished=True).count(), 3)
@@ -3,11 +3,19 @@
 from django.contrib import admin
 from django.urls import include, path
 
-from gameness.views import ContestView, ContestGameView, ContestHighscoreView
+from gameness.metrics import metrics_view
+from gameness.views import ContestView, ContestAssetsView, ContestGameView, ContestGameBatchView, ContestHighscoreView, \
+    ContestLeaderboardView, ContestRankView, ExportView
 
 urlpatterns = [
     path(r'', ContestView.as_view(), name='contest_contest'),
     path('contests/api/', ContestGameView.as_view(), name='contest_game_view'),
+    path('contests/api/batch/', ContestGameBatchView.as_view(), name='contest_game_batch_view'),
+    path('contests/assets/<int:rows>x<int:columns>.js', ContestAssetsView.as_view(), name='contest_game_assets'),
     path('contests/highscore/', ContestHighscoreView.as_view(), name='contest_highscore'),
+    path('contests/leaderboard/', ContestLeaderboardView.as_view(), name='contest_leaderboard'),
+    path('contests/rank/', ContestRankView.as_view(), name='contest_rank'),
+    path('metrics/', metrics_view, name='metrics'),
+    path('export/<str:dataset>.<str:format>', ExportView.as_view(), name='export'),
     path('admin/', admin.site.urls),
 ]
@@ -7,14 +7,21 @@ from decimal import Decimal
 from random import choice
 
 from django.conf import settings
-from django.contrib.staticfiles.templatetags.staticfiles import static
 from django.core.serializers.json import DjangoJSONEncoder
-from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.decorators import method_decorator
 from django.utils.encoding import smart_text
 from django.views import View
+from django.views.decorators.http import condition
 from django.views.generic.base import ContextMixin, TemplateView
 
+from gameness import assets, db, export, gamestate, highscores, leaderboard, metrics, ranks
+from gameness import playfield as playfields
 from gameness.models import Game
+from gameness.pool import playfield_pool
 
 log = logging.getLogger(__name__)
 
@@ -47,23 +54,62 @@ class ContestGameView(View, ContextMixin):
                  If the game is completed, then return {'success': True, 'completed': True, 'score': <score>}
         """
 
+        game = self.get_active_game(request)
+        if isinstance(game, JsonResponse):
+            return game
+
+        context = {"success": True}
+        context.update(aquire_csrf(self.request))
+        player = game.player
+
+        try:
+            click = self.parse_click(request.POST["click"])
+        except (KeyError, TypeError, ValueError):
+            log.warning(f"User: {player} sent an invalid click for game {game.pk}.")
+            return JsonResponse({"success": False, "msg": "Invalid click."}, status=400)
+
+        def play():
+            with metrics.timer("game_view.load_state"):
+                state = gamestate.load(request, game)
+            with metrics.timer("game_view.play_click"):
+                return state, self.play_click(request, state, click)
+
+        try:
+            # The writes of a click are one transaction, run again on a locked database with the game reloaded
+            state, result = db.atomic_retry(play, on_retry=game.refresh_from_db)
+            context.update(result)
+        except IndexError:
+            log.warning(f"User: {player} clicked outside of the playfield in game {game.pk}: {click}")
+            return JsonResponse({"success": False, "msg": "Invalid click."}, status=400)
+        except gamestate.IllegalMove as e:
+            log.warning(f"User: {player} made an illegal move in game {game.pk}: {e}")
+            return JsonResponse({"success": False, "msg": "Illegal move."}, status=400)
+
+        if not context.get("completed"):
+            with metrics.timer("game_view.save_state"):
+                state.save()
+
+        # Don't forget to update the csrf token
+        if "csrf_token" in context.keys():
+            context.update({"csrf_token": smart_text(context["csrf_token"])})
+
+        return JsonResponse(context)
+
+    def get_active_game(self, request):
+        """
+        Get the active game of the session
+        :param request:
+        :return: Game, or the JsonResponse to return if there is no active game
+        """
         if not "game" in request.session:
             log.warning("Game id not found in session, severe error.")
             return JsonResponse({'success': False}, status=500)
 
-        context = {"success": True}
-        context.update(aquire_csrf(self.request))
         player = request.session["player"]
         game_id = request.session['game']
 
-        # Basic instructions
-        # Extract the click being reported
-        # Check which card is at the position the click targeted (check
-        # All full Turns (two clicks) should be serialized in the database as json
-        # Check if there is a match if second click and save it
-
         try:
-            game = Game.objects.get(pk=game_id, player=player, active=True, finished=False)
+            return Game.objects.get(pk=game_id, player=player, active=True, finished=False)
         except Game.DoesNotExist:
             context = {"success": False, "msg": "No active game session found."}
 
@@ -71,34 +117,100 @@ class ContestGameView(View, ContextMixin):
                 f"User: {player} There is no active game associated with this session or the game in the session does not exists {game_id}.")
             return JsonResponse(context, status=404)
 
-        # Part 1: Insert code here
+    @staticmethod
+    def parse_click(data):
+        """
+        Parse a click sent by the frontend
+        :param data: json string or dict {'row': y, 'column': x}
+        :return: {'row': y, 'column': x}
+        """
+        click = json.loads(data) if hasattr(data, 'startswith') else data
+        return {'row': int(click['row']), 'column': int(click['column'])}
 
+    def play_click(self, request, state, click):
+        """
+        Play one click and finish the game off if it has been completed
+        :param request:
+        :param state: gamestate.GameState of the active game
+        :param click: {'row': y, 'column': x}
+        :return: the result of the click, see post
+        """
+        context = state.play(click)
+        if self.game_completed(state):
+            # A finishing click which is rolled back leaves the game active, and in the session
+            transaction.on_commit(lambda: request.session.pop("game", None))
+            with metrics.timer("game_view.finish"):
+                state.finish()
+            context.update({"completed": True, "score": state.game.game_score()})
+        return context
 
+    def game_completed(self, state):
+        """
+        Method which checks if every pair has been found to finish the game
+        :param state: gamestate.GameState of the game
+        :return: True/False whether the game is finished or not
+        """
+        return state.completed()
 
-        # Part 2: Check if the game has been finished and ifso,
-            # Calculate a score save it to Game.score, see class methods
-            # Fill in any relevant variables in the Game class
-            # Finish the game off with cleaning up variables and call Game.set_finished()
-            # Check whether the game was considered Suspected with the SuspectedGame class
-            # if the Game is finished, return according to method documentation above
 
-        if self.game_completed(game):
-            request.session.pop("game")
-            # Insert code here
+class ContestGameBatchView(ContestGameView):
+    """
+    Batch version of ContestGameView, plays several clicks of the active game in one request.
+    """
 
-        # Don't forget to update the csrf token
-        if "csrf_token" in context.keys():
-            context.update({"csrf_token": smart_text(context["csrf_token"])})
+    def post(self, request, *args, **kwargs):
+        """
+        Wants an ordered list of clicks, request.POST["clicks"] = [{'row': y, 'column': x}, ...], for example both
+        clicks of a turn. The clicks are played in order in one transaction, clicks after the one completing the game
+        are ignored. If any click is invalid nothing is played.
+
+        :param request: Will contain "clicks" in the POST
+        :param args:
+        :param kwargs:
+        :return: {'success': True, 'results': [<result of every click, same as ContestGameView.post>]}
+        """
+        game = self.get_active_game(request)
+        if isinstance(game, JsonResponse):
+            return game
 
+        player = game.player
+        try:
+            clicks = [self.parse_click(click) for click in json.loads(request.POST["clicks"])]
+        except (KeyError, TypeError, ValueError):
+            log.warning(f"User: {player} sent invalid clicks for game {game.pk}.")
+            return JsonResponse({"success": False, "msg": "Invalid clicks."}, status=400)
+
+        if not 0 < len(clicks) <= settings.GAME_BATCH_MAX_CLICKS:
+            return JsonResponse({"success": False, "msg": "Invalid number of clicks."}, status=400)
+
+        results = []
+
+        def play():
+            del results[:]
+            state = gamestate.load(request, game)
+            for click in clicks:
+                result = {"success": True}
+                result.update(self.play_click(request, state, click))
+                results.append(result)
+                if result.get("completed"):
+                    break
+            else:
+                state.save()
+
+        try:
+            db.atomic_retry(play, on_retry=game.refresh_from_db)
+        except IndexError:
+            log.warning(f"User: {player} clicked outside of the playfield in game {game.pk}: {clicks[len(results)]}")
+            return JsonResponse({"success": False, "msg": "Invalid click.", "index": len(results)}, status=400)
+        except gamestate.IllegalMove as e:
+            log.warning(f"User: {player} made an illegal move in game {game.pk}: {e}")
+            return JsonResponse({"success": False, "msg": "Illegal move.", "index": len(results)}, status=400)
+
+        context = {"success": True, "results": results}
+        context.update(aquire_csrf(self.request))
+        context.update({"csrf_token": smart_text(context["csrf_token"])})
         return JsonResponse(context)
 
-    def game_completed(self, game):
-        """
-        Method which checks if there are enough matched rounds to finish the game
-        :param game: Game object
-        :return: True/False whether the game is finished or not
-        """
-        return None
 
 class ContestView(TemplateView):
     """
@@ -108,54 +220,101 @@ class ContestView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super(ContestView, self).get_context_data(**kwargs)
+        dimensions = self.get_dimensions()
         player = choice(settings.USER_EMAILS)
         context["player"] = self.request.session["player"] = player
         self.request.session["game_id"] = uuid.uuid4().hex
         context.update(aquire_csrf(self.request))
 
-        Game.objects.stop_active_games_for_player(player)
-
         if "game" in self.request.session:
             game_id = self.request.session.pop("game", None)
             log.warning(f"Found existing game in session, removing: {game_id}")
+            gamestate.flush_game(game_id)
 
         if "click" in self.request.session:
             click = self.request.session.pop("click", None)
             log.warning(f"Found existing click in session, removing: {click}")
+            self.request.session.pop("click_at", None)
+
+        board = playfield_pool.pop(dimensions[0], dimensions[1])
+        if board is None:
+            seed = uuid.uuid4().hex
+            engine = settings.PLAYFIELD_ENGINE
+            board = (seed, engine, playfields.generate_board(dimensions[0], dimensions[1], seed, engine).to_bytes())
+        seed, engine, board_data = board
 
-        seed = uuid.uuid4().hex
-        dimensions = list(map(int, "2x3".split("x")))
-        game = Game.objects.create(player=player, active=True, finished=False, game_type=Game.MEMORY, seed=seed,
-                                   playfield=Game.generate_play_field(dimensions[0], dimensions[1], seed)[0])
+        def create_game():
+            Game.objects.stop_active_games_for_player(player)
+            return Game.objects.create(player=player, active=True, finished=False, game_type=Game.MEMORY, seed=seed,
+                                       engine=engine, board_data=board_data)
+
+        game = db.atomic_retry(create_game)
         self.request.session["game"] = game.pk
         context.update(self.get_game_context(dimensions))
 
         return context
 
+    def get_dimensions(self):
+        """
+        Board of the new game, ?board=<rows>x<columns> if it is one of settings.GAME_BOARD_SIZES,
+        settings.GAME_BOARD_SIZE if there is none
+        :return: [rows, columns]
+        """
+        size = self.request.GET.get("board", settings.GAME_BOARD_SIZE)
+        if size not in settings.GAME_BOARD_SIZES:
+            raise Http404("Unknown board dimensions")
+        return list(playfields.parse_dimensions(size))
+
     def get_game_context(self, dimensions):
+        """
+        The per game part of the game data, the static part is served by ContestAssetsView and merged in the page
+        :param dimensions: [rows, columns]
+        :return:
+        """
         context = {}
         game_name = "Memory"
-        high_score_game = Game.objects.filter(player=self.request.session["player"], score__gt=0.0).order_by(
-            "score").first()
+        best_game = Game.objects.get_player_best_score(self.request.session["player"])
+        context["best_score"] = best_game.score if best_game else Decimal("0.0")
+        context["rows"], context["columns"] = dimensions
         game_data = {
             "success": True,
-            "name": "Memory",
-            "best_score": high_score_game.score if high_score_game else Decimal("0.0"),
+            "best_score": context["best_score"],
             "rows": dimensions[0],
             "cols": dimensions[1],
-            "pieces": [static(f"img/memory/stack/{i}.jpg") for i in range(1, 11)],
-            "backPiece": static("img/memory/card-backside-default.png"),
-            "font_url": static("games/fonts/press-start-2p.css"),
-            "font_family": "Press Start 2P",
-            "audio_win": static("games/sfx/memory-win.wav"),
-            "audio_hit": static("games/sfx/memory-hit.wav"),
-            "audio_miss": static("games/sfx/memory-miss.wav")
         }
         context["game_data"] = json.dumps(game_data, cls=DjangoJSONEncoder)
         context["game_name"] = game_name
         return context
 
 
+def manifest_etag(request, rows, columns):
+    return assets.game_manifest(rows, columns).etag
+
+
+def manifest_last_modified(request, rows, columns):
+    return assets.game_manifest(rows, columns).last_modified
+
+
+@method_decorator(condition(etag_func=manifest_etag, last_modified_func=manifest_last_modified), name='get')
+class ContestAssetsView(View):
+    """
+    Static game data of a board dimension as a script setting gameAssets, see gameness/assets.py. The browser keeps
+    it for settings.GAME_ASSETS_MAX_AGE seconds and revalidates it with the ETag after that.
+    """
+
+    def dispatch(self, request, rows, columns, *args, **kwargs):
+        # Before the condition decorator builds the manifest for its validators
+        if f"{rows}x{columns}" not in settings.GAME_BOARD_SIZES:
+            raise Http404("Unknown board dimensions")
+        return super(ContestAssetsView, self).dispatch(request, rows, columns, *args, **kwargs)
+
+    def get(self, request, rows, columns, *args, **kwargs):
+        response = HttpResponse(assets.game_manifest(rows, columns).script,
+                                content_type="application/javascript; charset=utf-8")
+        patch_cache_control(response, public=True, max_age=settings.GAME_ASSETS_MAX_AGE)
+        return response
+
+
 class ContestHighscoreView(TemplateView):
     """
     Contest Highscoreview shows a page with the players highscore and a complete highscore list.
@@ -167,6 +326,92 @@ class ContestHighscoreView(TemplateView):
         context = super(ContestHighscoreView, self).get_context_data(**kwargs)
         context["player"] = self.request.session["player"]
         context["best_score"] = Game.objects.get_player_best_score(context["player"])
-        context["highscores"] = Game.objects.get_highscores()[:5]
-        context["unique_highscores"], _ = Game.objects.get_unique_highscores()[:5]
+        context["unique_highscores"] = highscores.get_unique_highscores()
+        context["rank"] = ranks.player_rank(context["player"])
         return context
+
+
+class ContestRankView(View):
+    """
+    Rank of a player on the leaderboard, and the players around it, as JSON.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        :param request: ?player=<email>, the player of the session if not given, ?rank=<k> for the players around a
+                        rank instead, ?radius=<n> players before and after (at most 50)
+        :return: {'success': True, 'player', 'rank', 'score', 'players', 'around': [{'rank', 'player', 'score'}]}
+        """
+        try:
+            radius = max(0, min(int(request.GET.get("radius", 5)), 50))
+            rank = int(request.GET["rank"]) if "rank" in request.GET else None
+        except ValueError:
+            return JsonResponse({"success": False, "msg": "Invalid rank or radius."}, status=400)
+
+        if rank is not None:
+            index = ranks.get_index()
+            return JsonResponse({"success": True, "players": len(index), "around": index.around(rank, radius)},
+                                encoder=DjangoJSONEncoder)
+
+        player = request.GET.get("player") or request.session.get("player")
+        if not player:
+            return JsonResponse({"success": False, "msg": "No player."}, status=400)
+        context = {"success": True, "player": player}
+        context.update(ranks.player_rank(player, radius))
+        return JsonResponse(context, encoder=DjangoJSONEncoder)
+
+
+class ContestLeaderboardView(View):
+    """
+    The whole leaderboard as JSON, one page at a time, see gameness/leaderboard.py.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        :param request: ?mode=games (every finished game) or players (the best game of every player), ?cursor=<next
+                        cursor of the previous page>, ?size=<rows per page, at most settings.LEADERBOARD_PAGE_MAX>
+        :return: {'success': True, 'mode', 'results': [<row>], 'next': <cursor of the next page or None>}
+        """
+        mode = request.GET.get("mode", "players")
+        if mode not in leaderboard.MODES:
+            return JsonResponse({"success": False, "msg": "Invalid mode."}, status=400)
+        try:
+            size = int(request.GET.get("size", settings.LEADERBOARD_PAGE_SIZE))
+            results, cursor = leaderboard.page(mode, request.GET.get("cursor") or None,
+                                               max(1, min(size, settings.LEADERBOARD_PAGE_MAX)))
+        except ValueError:
+            return JsonResponse({"success": False, "msg": "Invalid cursor or size."}, status=400)
+        return JsonResponse({"success": True, "mode": mode, "results": results, "next": cursor},
+                            encoder=DjangoJSONEncoder)
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class ExportView(View):
+    """
+    Streams a whole dataset for offline analysis, /export/<dataset>.<format> with a dataset of export.DATASETS and
+    csv or jsonl as format. Staff only. The response is gzip encoded when the client accepts it.
+    """
+
+    def get(self, request, dataset, format, *args, **kwargs):
+        """
+        :param request: ?after=<id> only exports the rows after that primary key, to resume an export
+        :param dataset: games, turns, suspected or leaderboard
+        :param format: csv or jsonl
+        :return: StreamingHttpResponse
+        """
+        if dataset not in export.DATASETS or format not in export.FORMATS:
+            raise Http404("Unknown export")
+        try:
+            after = int(request.GET.get("after", 0))
+        except ValueError:
+            return JsonResponse({"success": False, "msg": "Invalid after."}, status=400)
+
+        lines = export.lines(dataset, format, after=after)
+        if "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", ""):
+            response = StreamingHttpResponse(export.gzip_stream(lines), content_type=export.CONTENT_TYPES[format])
+            response["Content-Encoding"] = "gzip"
+        else:
+            response = StreamingHttpResponse(export.buffered(lines), content_type=export.CONTENT_TYPES[format])
+        patch_vary_headers(response, ("Accept-Encoding",))
+        response["Content-Disposition"] = f'attachment; filename="{dataset}.{format}"'
+        return response
@@ -5,3 +5,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gameness.settings")
 
 application = get_wsgi_application()
+
+# Fill the playfield pool before the first game is asked for
+from gameness.pool import playfield_pool
+playfield_pool.warm()